@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Read the converted weekly archive (v2/) one window at a time.
+
+Only the weeks overlapping the time window are opened. Within a week, the
+block index skips to the hours asked for (see read_time_range_lines), and
+route/vehicle filters are matched against each line's bytes before any
+JSON is decoded, so a route's records come out of a week without parsing
+the rest of it. Results are generated in batches of dicts or DataFrames;
+a whole week is never held in memory.
+
+Times are UTC snapshot times: datetimes (naive = UTC) or ISO strings such
+as "2021-11-08" or "2021-11-08T06:00". Partitioned archives
+(--partition-by route) only open the routes asked for.
+
+Usage:
+    from bustimes_reader import read_dataframes
+    for df in read_dataframes("v2", "2021-11-08", "2021-11-15", routes=[19]):
+        ...
+
+    python bustimes_reader.py v2 --start 2021-11-08 --end 2021-11-09 --route 19 > route19.jsonl
+"""
+
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+
+from scripts.convert_bustimes import (
+    COMPRESSIONS,
+    JsonlWeekWriter,
+    read_time_range_lines,
+    week_to_dates,
+)
+
+# Records per batch from read_records / rows per DataFrame from read_dataframes
+DEFAULT_BATCH_SIZE = 50000
+
+WEEK_RE = re.compile(r"^(\d{4}-W\d{2})\.jsonl\.\w+$")
+
+# Every extension a weekly JSONL output can have (.jsonl.gz, .jsonl.zst)
+JSONL_EXTENSIONS = sorted({JsonlWeekWriter.extension + codec.suffix for codec in COMPRESSIONS.values()})
+
+
+def to_datetime(value) -> datetime.datetime | None:
+    """Return a UTC datetime for a datetime, date or ISO string (None stays None)."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    elif not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+def archive_weeks(archive_dir: str) -> list[str]:
+    """Return the week labels converted under archive_dir, oldest first."""
+    weeks = set()
+    for name in os.listdir(archive_dir):
+        m = WEEK_RE.match(name)
+        if m and name.endswith(tuple(JSONL_EXTENSIONS)):
+            weeks.add(m.group(1))
+    markers = os.path.join(archive_dir, "_weeks")
+    if os.path.isdir(markers):
+        weeks.update(name.removesuffix(".json") for name in os.listdir(markers) if name.endswith(".json"))
+    return sorted(weeks)
+
+
+def week_overlaps(week: str, start: datetime.datetime | None, end: datetime.datetime | None) -> bool:
+    """Return True if the ISO week shares any time with [start, end)."""
+    monday = datetime.datetime.combine(week_to_dates(week)[0], datetime.time(), datetime.timezone.utc)
+    return (end is None or monday < end) and (start is None or monday + datetime.timedelta(days=7) > start)
+
+
+def week_paths(archive_dir: str, week: str, routes: set | None = None) -> list[str]:
+    """Return the JSONL files holding a week: one file, or its route partitions."""
+    marker = os.path.join(archive_dir, "_weeks", f"{week}.json")
+    if os.path.exists(marker):
+        with open(marker) as f:
+            partitions = json.load(f)["partitions"]
+        if routes is not None:
+            wanted = {str(route) for route in routes}
+            partitions = {value: p for value, p in partitions.items() if value in wanted}
+        return [
+            os.path.join(archive_dir, partition["path"])
+            for _, partition in sorted(partitions.items())
+            if partition["path"].endswith(tuple(JSONL_EXTENSIONS))
+        ]
+    for extension in JSONL_EXTENSIONS:
+        path = os.path.join(archive_dir, week + extension)
+        if os.path.exists(path):
+            return [path]
+    return []
+
+
+def field_pattern(field: str, values) -> re.Pattern:
+    """Match `"field":value` for any of values in a compact JSON line."""
+    alternatives = b"|".join(re.escape(json.dumps(value).encode()) for value in values)
+    return re.compile(b'"' + field.encode() + b'":(?:' + alternatives + b")[,}]")
+
+
+def iter_lines(archive_dir: str, start=None, end=None, routes=None, vehicles=None, weeks=None):
+    """Yield the raw JSONL lines (bytes) that pass the filters; see read_records.
+
+    Lines are only prefiltered: a filtered field nested inside another value
+    could still match, so decode and check them (read_records does).
+    """
+    start, end = to_datetime(start), to_datetime(end)
+    patterns = []
+    if routes is not None:
+        patterns.append(field_pattern("routeNumber", routes))
+    if vehicles is not None:
+        patterns.append(field_pattern("vehicleID", vehicles))
+    for week in archive_weeks(archive_dir):
+        if weeks is not None and week not in weeks:
+            continue
+        if not week_overlaps(week, start, end):
+            continue
+        for path in week_paths(archive_dir, week, routes):
+            for line in read_time_range_lines(path, start, end):
+                if all(pattern.search(line) for pattern in patterns):
+                    yield line
+
+
+def read_records(
+    archive_dir: str,
+    start=None,
+    end=None,
+    routes=None,
+    vehicles=None,
+    columns: list[str] | None = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    weeks=None,
+):
+    """Yield lists of up to batch_size records with start <= snapshot_time < end.
+
+    `routes` and `vehicles` are routeNumber and vehicleID values to keep
+    (None keeps all). `columns` trims each record to those fields. `weeks`
+    limits reading to those week labels (e.g. "2021-W45"), whole. Records
+    come in archive order: by week, then partition, then snapshot.
+    """
+    routes = set(routes) if routes is not None else None
+    vehicles = set(vehicles) if vehicles is not None else None
+    batch = []
+    for line in iter_lines(archive_dir, start, end, routes, vehicles, weeks):
+        record = json.loads(line)
+        if routes is not None and record.get("routeNumber") not in routes:
+            continue
+        if vehicles is not None and record.get("vehicleID") not in vehicles:
+            continue
+        if columns is not None:
+            record = {name: record.get(name) for name in columns}
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_dataframes(archive_dir: str, start=None, end=None, routes=None, vehicles=None,
+                    columns: list[str] | None = None, batch_size: int = DEFAULT_BATCH_SIZE, weeks=None):
+    """Yield pandas DataFrames of up to batch_size rows; see read_records."""
+    import pandas as pd
+
+    for batch in read_records(archive_dir, start, end, routes, vehicles, columns, batch_size, weeks):
+        yield pd.DataFrame.from_records(batch, columns=columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Write the archive's records in a time window as JSONL to stdout."
+    )
+    parser.add_argument("archive_dir", help="Directory of converted weeks, e.g. v2")
+    parser.add_argument("--start", help="First snapshot time (UTC), e.g. 2021-11-08")
+    parser.add_argument("--end", help="Snapshot time (UTC) to stop before")
+    parser.add_argument("--route", type=int, action="append", dest="routes",
+                        help="routeNumber to keep (repeatable)")
+    parser.add_argument("--vehicle", type=int, action="append", dest="vehicles",
+                        help="vehicleID to keep (repeatable)")
+    parser.add_argument("--count", action="store_true", help="Print the record count only")
+    args = parser.parse_args()
+
+    count = 0
+    out = sys.stdout.buffer
+    for batch in read_records(args.archive_dir, args.start, args.end, args.routes, args.vehicles):
+        count += len(batch)
+        if not args.count:
+            out.writelines(json.dumps(record, separators=(",", ":")).encode() + b"\n" for record in batch)
+    if args.count:
+        print(count)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,36 @@
 #! /usr/bin/env python3
 
 import os
-import ast
 import pprint
 import json
-from multiprocessing.dummy import Pool
+from concurrent.futures import as_completed
 
 import boto3
 
-pool = Pool(16)
+from scripts.convert_bustimes import AsyncS3Fetcher, parse_repr
+
 s3 = boto3.resource('s3')
 bucket = s3.Bucket('bustimes-data')
 
-def format_and_save(obj):
-    fname = 'data_test/%s' % obj.key
-    if os.path.exists(fname):
-        print("Skipping", obj.key)
-    else:
-        print("Fetching", obj.key)
-        data_raw = obj.get()['Body'].read().decode('utf-8')
-        data = ast.literal_eval(data_raw)
-        with open(fname, 'w') as f:
-            json.dump(data, f, indent=2)
-        print("Saved to", fname)
+def format_and_save(key, data_raw):
+    fname = 'data_test/%s' % key
+    data = parse_repr(data_raw)
+    with open(fname, 'w') as f:
+        json.dump(data, f, indent=2)
+    print("Saved to", fname)
+
+if __name__ == '__main__':
+    search = bucket.objects.filter(Prefix='raw/bustimes__2018-05')
+    # GETs share one connection pool; concurrency backs off when S3 throttles.
+    # Leaving the block closes the fetcher's session & loop thread, even on errors
+    with AsyncS3Fetcher(anonymous=False, max_concurrency=64) as fetcher:
+        futures = {}
+        for obj in search.limit(60):
+            if os.path.exists('data_test/%s' % obj.key):
+                print("Skipping", obj.key)
+            else:
+                print("Fetching", obj.key)
+                futures[fetcher.submit(obj.key)] = obj.key
 
-search = bucket.objects.filter(Prefix='raw/bustimes__2018-05')
-pool.map(format_and_save, search.limit(60))
+        for future in as_completed(futures):
+            format_and_save(futures[future], future.result())
@@ -1,10 +1,11 @@
 #! /usr/bin/env python3
 
 import boto3
-import ast
 import pprint
 import json
 
+from scripts.convert_bustimes import parse_repr
+
 
 sample = []
 
@@ -14,7 +15,7 @@ search = bucket.objects.filter(Prefix='raw/bustimes__2018')
 for obj in search.limit(60*8):
     print("Fetching", obj.key)
     data_raw = obj.get()['Body'].read().decode('utf-8')
-    data = ast.literal_eval(data_raw)
+    data = parse_repr(data_raw)
     # pprint.pprint(data, indent=2)
     sample += data
 
@@ -1,13 +1,37 @@
 # coding: utf-8
 
 import argparse
+import json
+import os
+import sys
+from collections import deque, namedtuple
 
 import pandas as pd
 import numpy as np
 import datetime as dt
+import time
+
+from trip_store import TRIP_COLUMNS, write_trips
 
 parser = argparse.ArgumentParser()
 parser.add_argument("path_to_bus_trip_json_data")
+parser.add_argument("--pair", action="append", dest="pairs", metavar="ROUTE:FIRST:LAST",
+                    help="Extract trips for this route & stop pair (repeatable; default 19:1545:792)")
+parser.add_argument("--all-routes", action="store_true",
+                    help="Extract end-to-end trips for every route in the data")
+parser.add_argument("--all-stops", action="store_true",
+                    help="Extract trips between every ordered pair of stops, not just end to end")
+parser.add_argument("--route", type=int, action="append", dest="routes",
+                    help="Only this route with --all-routes/--all-stops/--segments (repeatable)")
+parser.add_argument("--start", help="With an archive directory: first snapshot time (UTC), e.g. 2021-11-08")
+parser.add_argument("--end", help="With an archive directory: snapshot time (UTC) to stop before")
+parser.add_argument("--workers", type=int, default=1,
+                    help="With an archive directory: weeks to extract in parallel (default: 1)")
+parser.add_argument("--segments", metavar="OUT_DIR",
+                    help="Save each route's stop-to-stop segment table here instead (see segment_tables)")
+parser.add_argument("--trip-store", metavar="TRIPS_JSONL",
+                    help="With an archive directory: add its new weeks' trips to this store, then "
+                         "save the whole store's trips (see report_trips)")
 
 # df.pivot_table(index=['tripID'], values=['event_day'], aggfunc='count').sort_values(by='event_day')
 #
@@ -81,165 +105,664 @@ def get_situation(row, first_stop, last_stop):
     else:
         return 'en_route'
 
-def main(df, save=True):
-    bus_line = 19
-    first_stop = 1545
-    last_stop = 792
-    df['first_stop'] = first_stop
-    df['last_stop'] = last_stop
 
+def get_situations(df, first_stop, last_stop):
+    """get_situation for every row at once, checked in the same order"""
+    return pd.Series(np.select(
+        [
+            df.nextLocID == first_stop,
+            df.nextLocID == last_stop,
+            df.lastLocID == first_stop,
+            df.lastLocID == last_stop,
+        ],
+        [
+            'approaching_first_stop',
+            'approaching_last_stop',
+            'leaving_first_stop',
+            'leaving_last_stop',
+        ],
+        default='en_route',
+    ), index=df.index)
+
+def get_datetimes(t):
+    """get_datetime for a whole column: naive local time, like fromtimestamp"""
+    t = np.asarray(t, dtype='int64')
+    # The local UTC offset only changes at DST transitions, so look it up
+    # once per hour, and per row only within an hour that has a transition
+    hours, inverse = np.unique(t // 3600000, return_inverse=True)
+    start = np.array([time.localtime(h * 3600).tm_gmtoff for h in hours.tolist()])
+    end = np.array([time.localtime(h * 3600 + 3599).tm_gmtoff for h in hours.tolist()])
+    offsets = start[inverse] * 1000
+    changing = (start != end)[inverse]
+    if changing.any():
+        offsets[changing] = [time.localtime(ms // 1000).tm_gmtoff * 1000 for ms in t[changing].tolist()]
+    return pd.Series(pd.to_datetime(t + offsets, unit='ms').astype('datetime64[us]'))
+
+def add_time_features(routes):
+    """Add the columns trips are grouped & aggregated by"""
+    start = routes.trip_start.dt
+    routes['weekday'] = start.day_name()
+    routes['hour'] = start.hour.astype('int64')
+    routes['weekday_num'] = start.weekday.astype('int64')
+    routes['trip_start_time'] = start.time
+    routes['time_of_day'] = (start.hour * 10000 + start.minute * 100 + start.second).astype('int64')
+    # timedelta.seconds, so whole days are dropped like before
+    routes['duration_minutes'] = routes.duration.dt.seconds / 60.0
+    return routes
+
+def extract_trips(df, bus_line=19, first_stop=1545, last_stop=792):
+    """
+    Find trips from leaving first_stop to leaving last_stop on bus_line.
+
+    Works on whole columns: one sort by vehicle & time, then the state
+    changes and the previous observation of each come from shifted
+    columns, masked where a new vehicle starts. A trip runs from a
+    vehicle's first observation leaving first_stop to its first one
+    leaving last_stop right after (see get_situation). Returns one row per
+    trip with TRIP_COLUMNS and add_time_features' columns, sorted by
+    trip_start, without incomplete trips or those at or above the 95th
+    percentile duration.
+    """
     df = df[df['routeNumber'] == bus_line]
-    df['event_timestamp'] = df.time.apply(get_datetime)
-    df['situation'] = df.apply(get_situation, args=[first_stop, last_stop], axis=1)
+    situation = get_situations(df, first_stop, last_stop)
 
-    df['weekday'] = df.event_timestamp.apply(get_weekday)
+    # Get only data points right after the bus leaves a stop (first or last stop)
+    leaving = situation.str.startswith('leaving').to_numpy()
+    leavings = df[leaving].assign(
+        situation=situation[leaving],
+        event_timestamp=get_datetimes(df.time[leaving]).to_numpy(),
+        first_stop=first_stop,
+        last_stop=last_stop,
+    )
+    leavings = leavings.sort_values(['vehicleID', 'event_timestamp'], kind='stable')
+
+    # Save only the rows where the situation/state changed (approaching => leaving),
+    # counting each vehicle's first row as a change
+    vehicle = leavings.vehicleID.to_numpy()
+    states = leavings.situation.to_numpy()
+    new_vehicle = np.r_[True, vehicle[1:] != vehicle[:-1]]
+    vroutes = leavings[new_vehicle | np.r_[True, states[1:] != states[:-1]]]
+
+    vehicle = vroutes.vehicleID.to_numpy()
+    first_of_vehicle = np.r_[True, vehicle[1:] != vehicle[:-1]]
+
+    def previous(column):
+        return vroutes[column].shift(1).mask(first_of_vehicle)
+
+    trip_start = previous('event_timestamp')
+    routes = vroutes.assign(
+        trip_start=trip_start, # Time leaving first stop
+        trip_end=vroutes.event_timestamp, # Time leaving last stop
+        duration=vroutes.event_timestamp - trip_start,
+        delay_start=previous('delay'),
+        delay_end=vroutes.delay,
+        block_start=previous('blockID').astype('str'),
+        block_end=vroutes.blockID.astype('str'),
+        distance=haversine_distance(
+            previous('latitude'),
+            previous('longitude'),
+            vroutes.latitude,
+            vroutes.longitude),
+    )
+
+    # Only keep the "ending" data points for each trip
+    routes = routes.loc[routes.situation == 'leaving_last_stop', TRIP_COLUMNS]
+
+    # Drop rows with NA durations (or any other missing field)
+    routes = routes.dropna()
 
-    # monday_trips = df[df.weekday == 'Monday']
+    # Drop outliers: these are generally over 4 hours or even multiple days
+    routes = routes[routes.duration < routes.duration.quantile(0.95)]
 
-    # vehicles = df.pivot_table(index=['vehicle_id'], values=['situation'], aggfunc=lambda x: len(x.unique())).sort_values(by='situation')
+    routes = add_time_features(routes.copy())
+    return routes.sort_values('trip_start')
 
+def stop_pairs(df, routes=None, all_stops=False):
+    """
+    (route, first_stop, last_stop) pairs seen in df, for extract_trips_for_pairs.
 
-    # Get only data points right after the bus leaves a stop (first or last stop)
-    leavings = df[df.situation.str.contains('leaving')]
-
-
-    # Work with a subset of columns
-    # leavings_simple = leavings[['vehicle_id', 'event_timestamp', 'situation']]
-
-    # Group by vehicle ID so our timeseries data makes sense
-
-    # vehicles = leavings.groupby('vehicle_id')
-
-    # Sample group of data points for a single vehicle
-    # k, v = list(vehicles)[2]
-    # k # vehicle_id
-    # v # dataframe
-
-
-    # all_routes_dataframes = []
-    # all_blocks = set()
-    #
-    # # @TODO for later
-    # for k, v in vehicles:
-
-    def stats_for_vehicle_groups(df):
-        df = df.sort_values('event_timestamp')
-
-        # Save only the rows where the situation/state changed (approaching => leaving)
-        state_changes = (df != df.shift(1)).situation
-        vroutes = df.loc[state_changes].copy()
-
-        previous_rows = vroutes.shift(1)
-
-        # Save the start time, end time & duration of each trip
-        vroutes['trip_start'] = previous_rows.event_timestamp # Time leaving first stop
-        vroutes['trip_end'] = vroutes.event_timestamp # Time leaving last stop
-        vroutes['duration'] = vroutes.trip_end - vroutes.trip_start
-
-        vroutes['delay_start'] = previous_rows.delay
-        vroutes['delay_end'] = vroutes.delay
-
-        # Save the block ID for the start and end of each trip
-        # These should always be the same, otherwise something is wrong
-        # with that data point.
-        vroutes['block_start'] = previous_rows.blockID.astype('str')
-        vroutes['block_end'] = vroutes.blockID.astype('str')
-
-        # Calculte the distance between each start and and point
-        # This should help validate data as well
-        vroutes['lat_start'] = previous_rows.latitude
-        vroutes['lon_start'] = previous_rows.longitude
-        vroutes['lat_end'] = vroutes.latitude
-        vroutes['lon_end'] = vroutes.longitude
-        vroutes['distance'] = vroutes.apply(get_distance, axis=1)
-
-        # Only keep the "ending" data points for each trip
-        completed_routes = vroutes[vroutes.situation.str.contains('last')]
-
-        # Only keep columns we are interested in, and order them
-        completed_routes = completed_routes[[
-                'duration',
-                'distance',
-                'delay', # at last stop observation
-                'trip_start',
-                'trip_end',
-                'delay_start',
-                'delay_end',
-                'first_stop',
-                'last_stop',
-                'block_start',
-                'block_end',
-                'vehicleID',
-                'type',
-                'tripID',
-                'situation',
-                'routeNumber',
-                'direction',
-                'bearing',
-                'lastLocID',
-                'lastStopSeq',
-                'loadPercentage', # at last stop observation
-                ]]
-
-        # print("Sample for vehicle #{}".format(k))
-        # print(completed_routes)
-
-        # all_routes_dataframes.append(completed_routes)
-        return completed_routes
-
-    # routes = pd.concat(all_routes_dataframes)
-    #  import ipdb; ipdb.set_trace()
-    routes = leavings.groupby('vehicleID', group_keys=False).apply(stats_for_vehicle_groups)
-    # unstack()?
-
-    # Drop rows with NA durations
-    routes = routes.dropna()
+    Each route & direction's stops are put in order by their median
+    lastStopSeq. By default a direction gives one pair, its first and last
+    stop (end-to-end trips); all_stops gives every ordered pair of its
+    stops, which grows with the square of the number of stops.
+    """
+    df = df.dropna(subset=['routeNumber', 'direction', 'lastLocID', 'lastStopSeq'])
+    if routes is not None:
+        df = df[df.routeNumber.isin(routes)]
+    seqs = df.groupby(['routeNumber', 'direction', 'lastLocID']).lastStopSeq.median()
+
+    pairs = []
+    for (route_number, _), stops in seqs.groupby(level=['routeNumber', 'direction']):
+        stops = stops.sort_values(kind='stable').index.get_level_values('lastLocID')
+        stops = stops.astype('int64').tolist()
+        if all_stops:
+            pairs.extend((int(route_number), first, last)
+                         for i, first in enumerate(stops) for last in stops[i + 1:])
+        elif len(stops) > 1:
+            pairs.append((int(route_number), stops[0], stops[-1]))
+    return list(dict.fromkeys(pairs))
+
+def extract_trips_for_pairs(df, pairs=None, outlier_quantile=0.95):
+    """
+    extract_trips for many (route, first_stop, last_stop) pairs in one pass.
+
+    The observations are sorted by route, vehicle & time once and indexed
+    by the stop each one last left, so a pair only looks at the rows at its
+    own two stops. Each pair's rows are the ones extract_trips gives for it
+    (outliers are dropped per pair, see finish_trips), told apart by
+    routeNumber, first_stop and last_stop. pairs=None takes every route's
+    end-to-end pairs (see stop_pairs).
+    """
+    if pairs is None:
+        pairs = stop_pairs(df)
+    # A stop paired with itself is always "leaving first stop": no trips
+    pairs = list(dict.fromkeys(
+        (route_number, first, last) for route_number, first, last in pairs if first != last))
+    stops = {stop for _, first, last in pairs for stop in (first, last)}
+    df = df[df.routeNumber.isin({route_number for route_number, _, _ in pairs}) & df.lastLocID.isin(stops)]
+
+    timestamps = get_datetimes(df.time).to_numpy()
+    order = np.lexsort((timestamps, df.vehicleID.to_numpy(), df.routeNumber.to_numpy()))
+    observations = df.take(order).assign(event_timestamp=timestamps[order])
+    vehicle = observations.vehicleID.to_numpy()
+    last_loc = observations.lastLocID.to_numpy()
+    next_loc = observations.nextLocID.to_numpy()
+    # (route, stop) -> positions of its observations, in vehicle & time order
+    at_stop = pd.Series(np.arange(len(observations))).groupby(
+        [observations.routeNumber.to_numpy(), last_loc]).indices
+
+    none = np.empty(0, dtype='int64')
+    ends, starts, pair_ids = [none], [none], [none]
+    for i, (route_number, first_stop, last_stop) in enumerate(pairs):
+        rows = np.sort(np.concatenate([
+            at_stop.get((route_number, first_stop), none),
+            at_stop.get((route_number, last_stop), none),
+        ]))
+        # Approaching either stop wins over leaving the other (get_situations)
+        rows = rows[(next_loc[rows] != first_stop) & (next_loc[rows] != last_stop)]
+        if not len(rows):
+            continue
+
+        # Keep the state changes, counting each vehicle's first row as one
+        leaving_last = last_loc[rows] == last_stop
+        v = vehicle[rows]
+        changed = np.r_[True, (v[1:] != v[:-1]) | (leaving_last[1:] != leaving_last[:-1])]
+        rows, leaving_last, v = rows[changed], leaving_last[changed], v[changed]
+
+        # States alternate, so every leaving_last_stop row after the
+        # vehicle's first ends a trip that started at the row before it
+        ended = np.flatnonzero(leaving_last & np.r_[False, v[1:] == v[:-1]])
+        ends.append(rows[ended])
+        starts.append(rows[ended - 1])
+        pair_ids.append(np.full(len(ended), i))
+
+    end = observations.take(np.concatenate(ends))
+    start = observations.take(np.concatenate(starts))
+    pair = np.concatenate(pair_ids)
+
+    def at_start(column):
+        # As extract_trips' shifted columns: integers come out as floats
+        values = start[column].to_numpy()
+        return values.astype('float64') if values.dtype.kind in 'iu' else values
+
+    stop_ids = np.array([(first, last) for _, first, last in pairs], dtype='int64').reshape(-1, 2)
+    trip_start = start.event_timestamp.to_numpy()
+    routes = end.assign(
+        situation='leaving_last_stop',
+        first_stop=stop_ids[pair, 0],
+        last_stop=stop_ids[pair, 1],
+        trip_start=trip_start, # Time leaving first stop
+        trip_end=end.event_timestamp.to_numpy(), # Time leaving last stop
+        duration=end.event_timestamp.to_numpy() - trip_start,
+        delay_start=at_start('delay'),
+        delay_end=end.delay.to_numpy(),
+        block_start=pd.Series(at_start('blockID')).astype('str').array,
+        block_end=end.blockID.astype('str').array,
+        distance=haversine_distance(
+            at_start('latitude'),
+            at_start('longitude'),
+            end.latitude.to_numpy(),
+            end.longitude.to_numpy()),
+    )[TRIP_COLUMNS]
+    return finish_trips(routes, pair, outlier_quantile)
+
+def finish_trips(routes, pair, outlier_quantile=0.95):
+    """
+    Drop incomplete trips and each pair's outliers, add the time features
+    and sort by pair & trip_start. pair numbers each row's (route,
+    first_stop, last_stop); outlier_quantile=None keeps every trip.
+    """
+    # Drop rows with NA durations (or any other missing field)
+    complete = routes.notna().all(axis=1).to_numpy()
+    routes, pair = routes[complete], pair[complete]
+
+    # Drop outliers, per pair since trip lengths differ between pairs
+    if outlier_quantile is not None:
+        cutoff = routes.duration.groupby(pair).transform('quantile', outlier_quantile).to_numpy()
+        short = routes.duration.to_numpy() < cutoff
+        routes, pair = routes[short], pair[short]
+
+    routes = add_time_features(routes.copy())
+    return routes.iloc[np.lexsort((routes.trip_start.to_numpy(), pair))]
+
+# Observation fields a trip row is made from
+STREAM_COLUMNS = [
+    'time', 'vehicleID', 'routeNumber', 'direction', 'lastLocID', 'nextLocID',
+    'lastStopSeq', 'tripID', 'blockID', 'type', 'bearing', 'delay',
+    'loadPercentage', 'latitude', 'longitude',
+]
+
+# Fields of a trip row (see trip_row): TRIP_COLUMNS less duration, with
+# trip_start & trip_end in epoch ms like the observations' time
+STREAM_TRIP_COLUMNS = [column for column in TRIP_COLUMNS if column != 'duration']
+
+# Fields of the observation an open trip started at
+START_FIELDS = ['time', 'delay', 'blockID', 'latitude', 'longitude']
+
+def trip_row(start, end, first_stop, last_stop):
+    """
+    A completed trip as a dict of STREAM_TRIP_COLUMNS: start holds
+    START_FIELDS of the observation leaving first_stop, end is the
+    observation leaving last_stop. None if a field is missing, since
+    extract_trips drops those trips.
+    """
+    start_time, delay_start, block_start, latitude, longitude = start
+    row = {column: end.get(column) for column in STREAM_TRIP_COLUMNS}
+    row.update(
+        trip_start=start_time,
+        trip_end=end['time'],
+        delay_start=delay_start,
+        delay_end=end.get('delay'),
+        first_stop=first_stop,
+        last_stop=last_stop,
+        # extract_trips' shifted blockID is a float, so '9031.0' vs '9031'
+        block_start=str(float(block_start)) if block_start is not None else 'nan',
+        block_end=str(end.get('blockID')),
+        situation='leaving_last_stop',
+        distance=0.0,
+    )
+    if any(value is None or value != value for value in (*start, *row.values())):
+        return None
+    row['distance'] = float(haversine_distance(latitude, longitude, end['latitude'], end['longitude']))
+    return row
+
+# A trip end a fresh TripStream can't settle alone: start is None, or its
+# own start, which a trip open before its stretch began would replace
+TripHead = namedtuple('TripHead', ['key', 'start', 'end', 'first_stop', 'last_stop'])
+
+class TripStream:
+    """
+    Completed trips for (route, first_stop, last_stop) pairs, from
+    observations fed in time order.
+
+    A small state machine per vehicle & pair stands in for extract_trips'
+    sort: leaving first_stop opens a trip (the earliest such observation
+    is kept), and leaving last_stop completes it. Only open trips are
+    held, so memory grows with the fleet rather than with the history.
+    Observations approaching either stop are skipped, as get_situations
+    ranks them first. Trips are the ones extract_trips_for_pairs finds,
+    before outliers are dropped, as long as each vehicle's observations
+    arrive in time order.
+
+    A fresh stream starts part way through the history (a week, in a
+    worker) without knowing which trips were open before: each vehicle &
+    pair's first leaving_last_stop, and the end of a trip opened by its
+    first leaving_first_stop, come out as TripHeads for stitch_trips.
+    """
 
-    # Drop outliers
-    # about 50 out of 4000 are over 100 minutes
-    # @TODO look more into these later
-    # routes = routes[routes.duration < dt.timedelta(seconds=(60*100))]
-    # routes = routes[scipy.stats.zscore(routes.duration) < 3]
-    # These are generally over 4 hours or event multiple days
-    routes = routes[routes.duration < routes.duration.quantile(0.95)]
+    def __init__(self, pairs, fresh=False):
+        self.pairs = list(dict.fromkeys(
+            (route_number, first, last) for route_number, first, last in pairs if first != last))
+        # (route, stop) -> [(pair index, whether it is the pair's last stop)]
+        self.stops = {}
+        for i, (route_number, first_stop, last_stop) in enumerate(self.pairs):
+            self.stops.setdefault((route_number, first_stop), []).append((i, False))
+            self.stops.setdefault((route_number, last_stop), []).append((i, True))
+        # (vehicleID, pair index) -> START_FIELDS of the open trip
+        self.open = {}
+        self.fresh = fresh
+        # Keys left a stop in this stream / whose open trip began at the first
+        self.seen = set()
+        self.head_open = set()
+
+    def feed(self, records):
+        """Yield a trip_row for each trip the records complete."""
+        for record in records:
+            at_stop = self.stops.get((record.get('routeNumber'), record.get('lastLocID')))
+            if at_stop is None:
+                continue
+            for i, leaving_last in at_stop:
+                _, first_stop, last_stop = self.pairs[i]
+                if record.get('nextLocID') in (first_stop, last_stop):
+                    continue
+                key = (record['vehicleID'], i)
+                first_seen = self.fresh and key not in self.seen
+                if first_seen:
+                    self.seen.add(key)
+                if not leaving_last:
+                    if key not in self.open:
+                        self.open[key] = [record.get(field) for field in START_FIELDS]
+                        if first_seen:
+                            self.head_open.add(key)
+                    continue
+                start = self.open.pop(key, None)
+                if first_seen or key in self.head_open:
+                    self.head_open.discard(key)
+                    end = {column: record.get(column) for column in STREAM_COLUMNS}
+                    yield TripHead(key, start, end, first_stop, last_stop)
+                elif start is not None:
+                    trip = trip_row(start, record, first_stop, last_stop)
+                    if trip is not None:
+                        yield trip
+
+    def state(self):
+        """The pairs & open trips as JSON-able lists, for TripStream.from_state."""
+        return {
+            'pairs': [list(pair) for pair in self.pairs],
+            'open': [[vehicle, i, start] for (vehicle, i), start in self.open.items()],
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        """A TripStream carrying on from state(), e.g. in the next week."""
+        stream = cls([tuple(pair) for pair in state['pairs']])
+        stream.open = {(vehicle, i): start for vehicle, i, start in state['open']}
+        return stream
+
+# Records decoded at a time by stream_trips
+STREAM_BATCH_SIZE = 5000
+
+def stream_trips(archive_dir, pairs, start=None, end=None, workers=1):
+    """
+    Yield trip rows (see trip_row) from the converted weekly archive.
+
+    Records are read STREAM_BATCH_SIZE at a time with bustimes_reader, only
+    for the pairs' routes, so memory stays flat however many weeks are
+    covered: at most a week's trips are held. workers > 1 extracts weeks
+    in parallel (see iter_week_trips).
+    """
+    from bustimes_reader import archive_weeks, to_datetime, week_overlaps
+
+    window = to_datetime(start), to_datetime(end)
+    weeks = [week for week in archive_weeks(archive_dir) if week_overlaps(week, *window)]
+    for _, trips in iter_week_trips(archive_dir, TripStream(pairs), weeks, workers, start, end):
+        yield from trips
+
+def week_records(archive_dir, routes, week, start=None, end=None):
+    """Yield one archive week's records for routes, STREAM_COLUMNS only."""
+    from bustimes_reader import read_records
 
-    # Add new columns for grouping & aggregating
-    routes['weekday'] = routes.trip_start.apply(
-            lambda t: t.strftime('%A'))
-    routes['hour'] = routes.trip_start.apply(
-            lambda t: t.hour)
-    routes['weekday_num'] = routes.trip_start.apply(
-            lambda t: t.weekday)
-    routes['trip_start_time'] = routes.trip_start.dt.time
-    routes['time_of_day'] = routes.trip_start.apply(
-            lambda t: t.strftime('%H%M%S')).astype('int')
-    routes['duration_minutes'] = routes.duration.apply(
-            lambda t: t.seconds/60.0)
+    for batch in read_records(archive_dir, start, end, routes=routes, columns=STREAM_COLUMNS,
+                              batch_size=STREAM_BATCH_SIZE, weeks=[week]):
+        yield from batch
 
-    # routes['duration_category'] = pd.cut(
-    #         routes.duration_minutes,
-    #         bins=7,
-    #         labels=['x_short', 'shorter', 'short', 'normal', 'long', 'longer', 'x-long'],
-    #         include_lowest=True,)
+def extract_week(archive_dir, pairs, week, start=None, end=None):
+    """
+    Run a fresh TripStream over one archive week, in a worker process.
 
+    Returns its trip rows & TripHeads in stream order, and the stream as it
+    ended the week, for stitch_trips.
+    """
+    stream = TripStream(pairs, fresh=True)
+    routes = {route_number for route_number, _, _ in stream.pairs}
+    return list(stream.feed(week_records(archive_dir, routes, week, start, end))), stream
 
-    # Sort
-    routes = routes.sort_values('trip_start')
+def stitch_trips(stream, items, week_stream):
+    """
+    Settle a week's extract_week output against stream, whose open trips
+    are as of the week's start. Returns the week's trip rows, the same as
+    feeding the week to stream would give, and moves stream to its end.
+    """
+    before = stream.open
+    trips = []
+    for item in items:
+        if isinstance(item, TripHead):
+            # A trip open before the week started earlier than any in it
+            start = before.get(item.key, item.start)
+            item = trip_row(start, item.end, item.first_stop, item.last_stop) if start is not None else None
+        if item is not None:
+            trips.append(item)
+
+    still_open = {key: start for key, start in before.items() if key not in week_stream.seen}
+    for key, start in week_stream.open.items():
+        if key in week_stream.head_open and key in before:
+            start = before[key]
+        still_open[key] = start
+    stream.open = still_open
+    return trips
+
+def iter_week_trips(archive_dir, stream, weeks, workers=1, start=None, end=None):
+    """
+    Yield (week, trip rows) for each of weeks in order, carrying stream's
+    open trips from one week to the next.
 
+    With workers > 1 the weeks are extracted in a process pool, a few
+    ahead, and stitched together in order; the trips are the same as one
+    stream over every week would give.
+    """
+    if workers <= 1:
+        routes = {route_number for route_number, _, _ in stream.pairs}
+        for week in weeks:
+            yield week, list(stream.feed(week_records(archive_dir, routes, week, start, end)))
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        weeks = iter(weeks)
+        while True:
+            for week in weeks:
+                pending.append((week, pool.submit(extract_week, archive_dir, stream.pairs, week, start, end)))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            week, future = pending.popleft()
+            items, week_stream = future.result()
+            yield week, stitch_trips(stream, items, week_stream)
+
+def trip_store_state_path(trips_path):
+    return trips_path + '.state.json'
+
+def update_trip_store(archive_dir, trips_path, pairs=None, workers=1):
+    """
+    Append the trips of archive weeks not processed yet to trips_path, a
+    JSON lines file of trip rows (see trip_row), and return those weeks.
+
+    A state file next to the store records its pairs, the weeks done, its
+    length and the trips still open at the end of the last week, so a trip
+    crossing into a new week is completed when that week is added. The
+    state is saved after every week; a store cut off part way through a
+    week is trimmed back to the last saved length on the next run. Only
+    weeks after the last one done are taken, since the open trips are as
+    of its end; older weeks converted later need a new store. workers > 1
+    extracts weeks in parallel (see iter_week_trips).
+    """
+    from bustimes_reader import archive_weeks
+
+    state_path = trip_store_state_path(trips_path)
+    if os.path.exists(state_path):
+        with open(state_path) as f:
+            state = json.load(f)
+        stream = TripStream.from_state(state)
+        if pairs is not None and TripStream(pairs).pairs != stream.pairs:
+            raise ValueError(f"{trips_path} holds trips for other pairs: {stream.pairs}")
+        # Duration sketches some earlier states kept; nothing reads them
+        state.pop('sketches', None)
+    elif os.path.exists(trips_path) and os.path.getsize(trips_path):
+        raise ValueError(f"{trips_path} has no {state_path} to add weeks from")
+    else:
+        stream = TripStream(pairs or [(19, 1545, 792)])
+        state = {'weeks': [], 'size': 0}
+
+    done = state['weeks']
+    weeks = [week for week in archive_weeks(archive_dir) if not done or week > done[-1]]
+    open(trips_path, 'ab').close()
+    with open(trips_path, 'r+b') as out:
+        out.seek(state['size'])
+        out.truncate()
+        for week, trips in iter_week_trips(archive_dir, stream, weeks, workers):
+            out.writelines(json.dumps(trip, separators=(',', ':')).encode() + b'\n' for trip in trips)
+            out.flush()
+            os.fsync(out.fileno())
+            done.append(week)
+            state.update(stream.state(), weeks=done, size=out.tell())
+            with open(state_path + '.tmp', 'w') as f:
+                json.dump(state, f)
+            os.rename(state_path + '.tmp', state_path)
+    return weeks
+
+def read_trip_store(trips_path, outlier_quantile=0.95):
+    """The trips in a store written by update_trip_store, see trips_dataframe."""
+    with open(trips_path) as f:
+        return trips_dataframe((json.loads(line) for line in f), outlier_quantile)
+
+def trips_dataframe(rows, outlier_quantile=0.95):
+    """Trip rows as the DataFrame extract_trips_for_pairs returns."""
+    trips = pd.DataFrame.from_records(list(rows), columns=STREAM_TRIP_COLUMNS)
+    trips['trip_start'] = get_datetimes(trips.trip_start).to_numpy()
+    trips['trip_end'] = get_datetimes(trips.trip_end).to_numpy()
+    trips['duration'] = trips.trip_end - trips.trip_start
+    trips['delay_start'] = trips.delay_start.astype('float64')
+    pair = trips.groupby(['routeNumber', 'first_stop', 'last_stop'], sort=False).ngroup().to_numpy()
+    return finish_trips(trips[TRIP_COLUMNS], pair, outlier_quantile)
+
+# Observation fields a segment table is built from
+SEGMENT_COLUMNS = ['time', 'vehicleID', 'routeNumber', 'direction', 'tripID', 'lastLocID', 'lastStopSeq']
+
+# Arrays of a route's segment table, and their types: the route, then one
+# entry per trip run (trip_*, with trip_offset one longer) or per stop it
+# left (stop_*)
+SEGMENT_ARRAYS = {
+    'route_number': 'int32', # a single value
+    'trip_vehicle': 'int32',
+    'trip_id': 'int64',
+    'trip_direction': 'int8',
+    'trip_start': 'int64', # epoch ms it was first seen past its first stop
+    'trip_offset': 'int64', # where its stops start in the stop_* arrays
+    'stop_id': 'int32',
+    'stop_seq': 'int16',
+    'stop_elapsed': 'int32', # ms from trip_start: the segment times summed
+}
+
+def segment_tables(df):
+    """
+    Stop-to-stop segment times of every vehicle trip in df, per route.
+
+    A trip run is a vehicle's observations with one tripID and a rising
+    lastStopSeq. For each stop it left, the table keeps the time it was
+    first seen past it, as ms elapsed since the run's first stop: a
+    prefix sum of the segment times between consecutive lastLocID
+    transitions, so any stop-to-stop duration is a difference of two
+    entries (see stop_to_stop). Returns {route: {array name: array}} with
+    the SEGMENT_ARRAYS.
+    """
+    df = df.dropna(subset=SEGMENT_COLUMNS)
+    order = np.lexsort((df.time.to_numpy(), df.vehicleID.to_numpy(), df.routeNumber.to_numpy()))
+    obs = {column: df[column].to_numpy()[order] for column in SEGMENT_COLUMNS}
+
+    def changed(column):
+        return np.r_[True, obs[column][1:] != obs[column][:-1]]
+
+    seq = obs['lastStopSeq']
+    new_run = changed('routeNumber') | changed('vehicleID') | changed('tripID') | np.r_[True, seq[1:] < seq[:-1]]
+    # The first observation past each stop of a run
+    passed = new_run | changed('lastStopSeq')
+    run = np.cumsum(new_run)[passed] - 1
+    first = np.r_[True, run[1:] != run[:-1]]
+    obs = {column: values[passed] for column, values in obs.items()}
+    offsets = np.flatnonzero(np.r_[first, True])
+    starts = obs['time'][first]
+
+    tables = {}
+    trip_routes = obs['routeNumber'][first]
+    for route_number in np.unique(trip_routes):
+        trips = np.flatnonzero(trip_routes == route_number)
+        stops = slice(offsets[trips[0]], offsets[trips[-1] + 1])
+        table = {
+            'route_number': np.asarray(route_number),
+            'trip_vehicle': obs['vehicleID'][first][trips],
+            'trip_id': obs['tripID'][first][trips],
+            'trip_direction': obs['direction'][first][trips],
+            'trip_start': starts[trips],
+            'trip_offset': offsets[trips[0]:trips[-1] + 2] - offsets[trips[0]],
+            'stop_id': obs['lastLocID'][stops],
+            'stop_seq': obs['lastStopSeq'][stops],
+            'stop_elapsed': obs['time'][stops] - np.repeat(starts[trips], np.diff(offsets[trips[0]:trips[-1] + 2])),
+        }
+        tables[int(route_number)] = {name: table[name].astype(dtype) for name, dtype in SEGMENT_ARRAYS.items()}
+    return tables
+
+def segment_table_path(out_dir, route_number):
+    return os.path.join(out_dir, 'route={}.segments.npz'.format(route_number))
+
+def save_segment_tables(tables, out_dir):
+    """Write each route's segment table to out_dir/route={N}.segments.npz."""
+    os.makedirs(out_dir, exist_ok=True)
+    for route_number, table in tables.items():
+        np.savez_compressed(segment_table_path(out_dir, route_number), **table)
+
+def load_segment_table(out_dir, route_number):
+    with np.load(segment_table_path(out_dir, route_number)) as f:
+        return {name: f[name] for name in SEGMENT_ARRAYS}
+
+def stop_to_stop(table, first_stop, last_stop):
+    """
+    Durations from first_stop to last_stop of every trip run in a segment
+    table that passed both in that order, without going back to the
+    observations. Columns are named as in extract_trips, so
+    add_time_features works on the result.
+    """
+    trip = np.repeat(np.arange(len(table['trip_start'])), np.diff(table['trip_offset']))
+    stop_id = table['stop_id']
+    # Each run's first pass of first_stop, and its next pass of last_stop
+    at_first = np.flatnonzero(stop_id == first_stop)
+    at_first = at_first[np.r_[True, trip[at_first][1:] != trip[at_first][:-1]]] if len(at_first) else at_first
+    at_last = np.flatnonzero(stop_id == last_stop)
+    following = np.searchsorted(at_last, at_first)
+    found = following < len(at_last)
+    at_first, at_last = at_first[found], at_last[following[found]]
+    same_trip = trip[at_first] == trip[at_last]
+    at_first, at_last = at_first[same_trip], at_last[same_trip]
+
+    runs = trip[at_first]
+    elapsed = table['stop_elapsed'].astype('int64')
+    start = table['trip_start'][runs] + elapsed[at_first]
+    end = table['trip_start'][runs] + elapsed[at_last]
+    trip_start = get_datetimes(start)
+    routes = pd.DataFrame({
+        'duration': get_datetimes(end) - trip_start,
+        'trip_start': trip_start,
+        'first_stop': first_stop,
+        'last_stop': last_stop,
+        'vehicleID': table['trip_vehicle'][runs],
+        'tripID': table['trip_id'][runs],
+        'routeNumber': int(table['route_number']),
+        'direction': table['trip_direction'][runs],
+    })
+    return routes.sort_values('trip_start', kind='stable', ignore_index=True)
+
+def main(df, save=True, pairs=None):
+    if pairs is None:
+        routes = extract_trips(df, bus_line=19, first_stop=1545, last_stop=792)
+    else:
+        routes = extract_trips_for_pairs(df, pairs)
+    return report_trips(routes, save)
 
+# Where report_trips saves trips (see trip_store.py)
+TRIP_STORE_DIR = 'completed_bus_routes'
 
-    print(routes.duration.describe())
+def report_trips(routes, save=True):
+    """Print trip durations (per pair if there are several) and save them to TRIP_STORE_DIR"""
+    by_pair = routes.groupby(['routeNumber', 'first_stop', 'last_stop']).duration
+    print(by_pair.describe() if by_pair.ngroups > 1 else routes.duration.describe())
     # print()
     # print(routes.pivot_table(index=['weekday', 'hour'], values='duration', aggfunc='mean'))
 
-    # import ipdb; ipdb.set_trace()
-
     if save:
-        route_number = routes.routeNumber.mode()[0] # Should be just one route number!!
-        # @TODO add trip start and end stops
-        fname = "completed_bus_routes-bus{}.pickle".format(route_number)
-        print("DataFrame saved to '{}'".format(fname))
-        routes.to_pickle(fname)
+        for route_number in write_trips(routes, TRIP_STORE_DIR):
+            print("Trips saved to '{}/route={}'".format(TRIP_STORE_DIR, route_number))
 
     return routes
 
@@ -274,5 +797,48 @@ see what variables describe variance
 if __name__ == '__main__':
 
     args = parser.parse_args()
-    data = pd.read_json(args.path_to_bus_trip_json_data)
-    main(data)
+    pairs = [tuple(int(x) for x in pair.split(':')) for pair in args.pairs or []]
+
+    if args.segments:
+        if os.path.isdir(args.path_to_bus_trip_json_data):
+            from bustimes_reader import read_dataframes
+            data = pd.concat(read_dataframes(args.path_to_bus_trip_json_data, args.start, args.end,
+                                             routes=args.routes, columns=SEGMENT_COLUMNS), ignore_index=True)
+        else:
+            data = pd.read_json(args.path_to_bus_trip_json_data, lines='.jsonl' in args.path_to_bus_trip_json_data)
+            if args.routes:
+                data = data[data.routeNumber.isin(args.routes)]
+        tables = segment_tables(data)
+        save_segment_tables(tables, args.segments)
+        for route_number, table in sorted(tables.items()):
+            print("Route {}: {} trips, {} stops passed -> '{}'".format(
+                route_number, len(table['trip_start']), len(table['stop_id']),
+                segment_table_path(args.segments, route_number)))
+        sys.exit()
+
+    # An archive directory (v2/) is streamed: trip rows go to stdout as
+    # JSON lines as they complete, before outliers are dropped (see
+    # trips_dataframe)
+    if os.path.isdir(args.path_to_bus_trip_json_data):
+        if args.all_routes or args.all_stops:
+            parser.error("streaming an archive needs each --pair listed")
+        if args.trip_store:
+            try:
+                weeks = update_trip_store(args.path_to_bus_trip_json_data, args.trip_store, pairs or None,
+                                          args.workers)
+            except ValueError as e:
+                parser.error(str(e))
+            print("Added {} week(s) to '{}': {}".format(len(weeks), args.trip_store, ' '.join(weeks)))
+            report_trips(read_trip_store(args.trip_store))
+            sys.exit()
+        out = sys.stdout
+        for trip in stream_trips(args.path_to_bus_trip_json_data, pairs or [(19, 1545, 792)],
+                                 args.start, args.end, args.workers):
+            out.write(json.dumps(trip, separators=(',', ':')) + '\n')
+        sys.exit()
+
+    # Converted weeks (v2/*.jsonl.gz) are JSON lines
+    data = pd.read_json(args.path_to_bus_trip_json_data, lines='.jsonl' in args.path_to_bus_trip_json_data)
+    if not pairs and (args.all_routes or args.all_stops or args.routes):
+        pairs = stop_pairs(data, args.routes, all_stops=args.all_stops)
+    main(data, pairs=pairs or None)
@@ -2,21 +2,23 @@
 
 import sys
 import urllib.request
-import ast
 import json
 
+from scripts.convert_bustimes import parse_repr
+
 
 def fix_json(data_raw):
     """
     The "JSON" data with bus times was actually a literal python string.
-    This converts the python to a json object.
+    This converts the python to a json object, using the fast repr
+    translator and falling back to ast.literal_eval.
     """
 
     # data_str = data_bytes.decode('utf-8')  # AWS api will return bytes
     data_str = data_raw
     try:
-        data_python = ast.literal_eval(data_str)
-    except ValueError as e:
+        data_python = parse_repr(data_str)
+    except (ValueError, SyntaxError) as e:
         # Catch this error otherwise the output is too long.
         print("Could not decode literal python string", e)
         sys.exit(1)
@@ -1,13 +1,18 @@
 import argparse
 import datetime as dt
+import os
 import pandas as pd
 import seaborn as sns
 from matplotlib import pyplot as plt
 
+from trip_store import read_trips, store_routes
+
 
 parser = argparse.ArgumentParser()
-parser.add_argument('completed_bus_trips_pickle')
+parser.add_argument('completed_bus_trips', help="Trip store directory (see trip_store.py) or an older .pickle")
 parser.add_argument('filename_for_figure_image')
+parser.add_argument('--route', type=int, help="Route to chart from the trip store (default: its only route)")
+parser.add_argument('--pair', metavar='FIRST:LAST', help="Stop pair to chart (default: the store's only pair)")
 
 
 def remove_outliers(df):
@@ -24,17 +29,41 @@ def add_columns(df):
     df['weekday_num'] = df.trip_start.dt.weekday
     return df
 
+def load_trips(path, route=None, pair=None):
+    if not os.path.isdir(path):
+        df = pd.read_pickle(path)
+    else:
+        routes = store_routes(path)
+        if not routes:
+            parser.error("{} holds no trips".format(path))
+        if route is None:
+            if len(routes) != 1:
+                parser.error("{} holds routes {}; pick one with --route".format(path, routes))
+            route = routes[0]
+        elif route not in routes:
+            parser.error("{} has no trips of route {}; it holds routes {}".format(path, route, routes))
+        df = read_trips(path, route)
+    if pair is not None:
+        first_stop, last_stop = pair
+        df = df[(df.first_stop == first_stop) & (df.last_stop == last_stop)]
+    elif 'first_stop' in df.columns:
+        pairs = sorted(set(zip(df.first_stop, df.last_stop)))
+        if len(pairs) > 1:
+            parser.error("{} holds stop pairs {}; pick one with --pair".format(path, pairs))
+    if df.empty:
+        parser.error("{} has no trips{}".format(
+            path, " from stop {} to {}".format(*pair) if pair is not None else ""))
+    return df
+
 def prep_data(df):
     df = remove_outliers(df)
     df = remove_weekends(df)
     df = add_columns(df)
     return df
 
-def make_histogram(df, fname):
+def make_histogram(df, fname, first_stop=1545, last_stop=792):
     ax = df.boxplot(column=['duration_minutes'], by='hour', figsize=(14, 6), rot=0, fontsize=15)
     bus_num = df.routeNumber.mode()[0]
-    first_stop = 1545 # df.first_stop.mode()[0]
-    last_stop = 792 # df.last_stop.mode()[0]
     num_samples = len(df)
     first_date = df.trip_start.min().strftime('%D')
     last_date = df.trip_start.max().strftime('%D')
@@ -50,6 +79,9 @@ def make_histogram(df, fname):
 if __name__ == '__main__':
 
     args = parser.parse_args()
-    df = pd.read_pickle(args.completed_bus_trips_pickle)
+    pair = tuple(int(stop) for stop in args.pair.split(':')) if args.pair else None
+    df = load_trips(args.completed_bus_trips, args.route, pair)
+    if pair is None and 'first_stop' in df.columns:
+        pair = df.first_stop.iloc[0], df.last_stop.iloc[0]
     df = prep_data(df)
-    make_histogram(df, args.filename_for_figure_image)
+    make_histogram(df, args.filename_for_figure_image, *(pair or (1545, 792)))
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Mergeable quantile sketches, for trip durations without the trips.
+
+A KLLSketch holds a bounded sample of the values it has seen: new values
+go into level 0, and when the levels are over capacity the lowest full one
+is sorted and every other value moves up a level, where it counts twice
+(Karnin, Lang & Liberty's KLL). With the default k=200 it holds at most
+about 3k values and estimates any quantile to within ~1% of the rank.
+Until a sketch first compacts it holds every value, and its quantiles are
+exactly pandas' (linear interpolation). Sketches of different trips merge
+into a sketch of all of them, so weekly or per-worker sketches add up.
+
+Compaction alternates which half of a level moves up instead of picking it
+at random, so the same values fed in the same order always give the same
+sketch.
+
+A SketchTable keeps a sketch per key, such as the trip store's
+(route, first_stop, last_stop, weekday, hour), and merges the ones
+sharing a key prefix on demand.
+
+Usage:
+    from quantile_sketch import SketchTable
+    table = SketchTable()
+    table.add((19, 1545, 792, 0, 8), 31.5)
+    table.merged(19, 1545, 792).quantile(0.95)
+"""
+
+import math
+
+import numpy as np
+
+# Values kept by the top level of a KLLSketch; each level below keeps 2/3
+# as many
+DEFAULT_K = 200
+
+
+class KLLSketch:
+    """Approximate quantiles of a stream of numbers in bounded memory."""
+
+    def __init__(self, k=DEFAULT_K):
+        self.k = k
+        self.count = 0
+        # Values held per level; a value at level h stands for 2**h values
+        self.levels = [[]]
+        # Per level, whether its next compaction keeps the odd positions
+        self.offsets = [0]
+        self.size = 0
+
+    def __len__(self):
+        return self.count
+
+    def capacity(self, level):
+        return int(math.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1))) + 1
+
+    def max_size(self):
+        return sum(self.capacity(level) for level in range(len(self.levels)))
+
+    def update(self, value):
+        self.levels[0].append(value)
+        self.count += 1
+        self.size += 1
+        if self.size >= self.max_size():
+            self.compress()
+
+    def extend(self, values):
+        values = list(values)
+        self.levels[0].extend(values)
+        self.count += len(values)
+        self.size += len(values)
+        while self.size >= self.max_size():
+            self.compress()
+
+    def merge(self, other):
+        """Add other's values to this sketch, and return it."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+            self.offsets.append(0)
+        for level, values in enumerate(other.levels):
+            self.levels[level].extend(values)
+        self.count += other.count
+        self.size = sum(len(values) for values in self.levels)
+        while self.size >= self.max_size():
+            self.compress()
+        return self
+
+    def compress(self):
+        """Halve the lowest level over capacity into the one above."""
+        for level, values in enumerate(self.levels):
+            if len(values) < self.capacity(level):
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+                self.offsets.append(0)
+            values.sort()
+            # An odd value out stays behind
+            kept = values[-1:] if len(values) % 2 else []
+            self.levels[level + 1].extend(values[self.offsets[level]:len(values) - len(kept):2])
+            self.offsets[level] ^= 1
+            self.levels[level] = kept
+            self.size = sum(len(values) for values in self.levels)
+            return
+
+    def weighted(self):
+        """The values held and their weights, sorted by value."""
+        values = np.array([value for values in self.levels for value in values], dtype='float64')
+        weights = np.concatenate([np.full(len(values), 2 ** level, dtype='int64')
+                                  for level, values in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], weights[order]
+
+    def quantiles(self, qs):
+        """
+        Estimate the qs quantiles, like Series.quantile: each value held
+        stands for `weight` equal values, and positions between two values
+        are interpolated linearly. NaN for an empty sketch.
+        """
+        qs = np.asarray(qs, dtype='float64')
+        if not self.count:
+            return np.full(qs.shape, np.nan)
+        values, weights = self.weighted()
+        first = np.cumsum(weights) - weights
+        last = first + weights - 1
+        positions = np.column_stack([first, last]).ravel()
+        points = np.repeat(values, 2)
+        distinct = np.r_[True, positions[1:] > positions[:-1]]
+        return np.interp(qs * (weights.sum() - 1), positions[distinct], points[distinct])
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
+
+    def state(self):
+        """The sketch as a JSON-able dict, for KLLSketch.from_state."""
+        return {'k': self.k, 'count': self.count, 'levels': self.levels, 'offsets': self.offsets}
+
+    @classmethod
+    def from_state(cls, state):
+        sketch = cls(state['k'])
+        sketch.count = state['count']
+        sketch.levels = [list(values) for values in state['levels']]
+        sketch.offsets = list(state['offsets'])
+        sketch.size = sum(len(values) for values in sketch.levels)
+        return sketch
+
+
+class SketchTable:
+    """A KLLSketch per key (a tuple), merged by key prefix when queried."""
+
+    def __init__(self, k=DEFAULT_K):
+        self.k = k
+        self.sketches = {}
+
+    def __len__(self):
+        return len(self.sketches)
+
+    def sketch(self, key):
+        """The sketch for key, created empty if there is none."""
+        sketch = self.sketches.get(key)
+        if sketch is None:
+            sketch = self.sketches[key] = KLLSketch(self.k)
+        return sketch
+
+    def add(self, key, value):
+        self.sketch(key).update(value)
+
+    def merge(self, other):
+        """Add other's sketches to this table's, and return it."""
+        for key, sketch in other.sketches.items():
+            self.sketch(key).merge(sketch)
+        return self
+
+    def merged(self, *prefix):
+        """One sketch of every key starting with prefix (all keys if none)."""
+        sketch = KLLSketch(self.k)
+        for key in sorted(key for key in self.sketches if key[:len(prefix)] == prefix):
+            sketch.merge(self.sketches[key])
+        return sketch
+
+    def state(self):
+        """The table as JSON-able lists, for SketchTable.from_state."""
+        return {'k': self.k, 'sketches': [[list(key), sketch.state()]
+                                          for key, sketch in self.sketches.items()]}
+
+    @classmethod
+    def from_state(cls, state):
+        table = cls(state['k'])
+        table.sketches = {tuple(key): KLLSketch.from_state(sketch) for key, sketch in state['sketches']}
+        return table
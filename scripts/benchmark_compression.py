@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Benchmark the --compression codecs of convert_bustimes.py on converted weeks.
+
+Compresses the first --sample-mb of each week with every codec and reports
+the compression ratio and compress/decompress throughput (MB/s of
+uncompressed JSONL) as a Markdown table. The zstd dictionary is trained on
+every 50th record of the same weeks; --save-dict keeps it for
+convert_bustimes.py --zstd-dict.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_compression v2/2017-W03.jsonl.gz v2/2021-W45.jsonl.gz v2/2025-W25.jsonl.gz
+    python -m scripts.benchmark_compression v2/*.jsonl.gz --save-dict bustimes.zdict
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from scripts.convert_bustimes import (
+    DEFAULT_ZSTD_DICT_SIZE,
+    GzipCodec,
+    ParallelGzipCodec,
+    ZstdCodec,
+    open_compressed,
+    train_zstd_dict,
+)
+
+# Chunk size handed to the codec, roughly one converted snapshot file
+WRITE_CHUNK = 256 * 1024
+
+
+def read_sample(path: str, limit: int) -> bytes:
+    """Return whole JSONL lines from the start of a week, up to `limit` bytes."""
+    lines = []
+    size = 0
+    with open_compressed(path) as f:
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= limit:
+                break
+    return b"".join(lines)
+
+
+def compress(codec, data: bytes, path: str) -> float:
+    """Write `data` through the codec to `path`; return the seconds taken."""
+    t0 = time.perf_counter()
+    with open(path, "wb") as raw:
+        stream = codec.open(raw)
+        for start in range(0, len(data), WRITE_CHUNK):
+            stream.write(data[start:start + WRITE_CHUNK])
+        stream.close()
+    return time.perf_counter() - t0
+
+
+def decompress(path: str) -> float:
+    """Read `path` back through open_compressed; return the seconds taken."""
+    t0 = time.perf_counter()
+    with open_compressed(path) as f:
+        while f.read(1024 * 1024):
+            pass
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare gzip, multithreaded gzip and zstd on converted weeks."
+    )
+    parser.add_argument("paths", nargs="+", help="Converted weekly .jsonl.gz/.jsonl.zst files")
+    parser.add_argument(
+        "--sample-mb", type=float, default=64,
+        help="Uncompressed MB to take from the start of each week (default: 64)",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=os.cpu_count() or 1,
+        help="Threads for gzip-mt and multithreaded zstd (default: CPU count)",
+    )
+    parser.add_argument(
+        "--dict-size", type=int, default=DEFAULT_ZSTD_DICT_SIZE,
+        help=f"zstd dictionary size in bytes (default: {DEFAULT_ZSTD_DICT_SIZE})",
+    )
+    parser.add_argument("--save-dict", help="Write the trained zstd dictionary here")
+    args = parser.parse_args()
+
+    print(f"Training a {args.dict_size // 1024} KB zstd dictionary...", flush=True)
+    dict_data = train_zstd_dict(args.paths, args.dict_size)
+    if args.save_dict:
+        with open(args.save_dict, "wb") as f:
+            f.write(dict_data)
+        print(f"  saved to {args.save_dict}")
+
+    codecs = [
+        ("gzip -6", GzipCodec(6)),
+        (f"gzip-mt -6 ({args.threads} threads)", ParallelGzipCodec(6, args.threads)),
+        ("zstd -3", ZstdCodec(3)),
+        ("zstd -3 + dict", ZstdCodec(3, dict_data=dict_data)),
+        (f"zstd -3 ({args.threads} threads)", ZstdCodec(3, args.threads)),
+        ("zstd -9 + dict", ZstdCodec(9, dict_data=dict_data)),
+    ]
+    totals = {name: [0, 0, 0.0, 0.0] for name, _ in codecs}  # raw, packed, c_s, d_s
+
+    limit = int(args.sample_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in args.paths:
+            data = read_sample(path, limit)
+            print(f"{os.path.basename(path)}: {len(data) / 1e6:.0f} MB sample", flush=True)
+            for name, codec in codecs:
+                codec.install(tmp)
+                out = os.path.join(tmp, "sample.jsonl" + codec.suffix)
+                c_s = compress(codec, data, out)
+                d_s = decompress(out)
+                total = totals[name]
+                total[0] += len(data)
+                total[1] += os.path.getsize(out)
+                total[2] += c_s
+                total[3] += d_s
+
+    print()
+    print("| codec | ratio | compress MB/s | decompress MB/s |")
+    print("|---|---:|---:|---:|")
+    for name, (raw, packed, c_s, d_s) in totals.items():
+        print(f"| {name} | {raw / packed:.1f}x | {raw / 1e6 / c_s:.0f} | {raw / 1e6 / d_s:.0f} |")
+
+
+if __name__ == "__main__":
+    main()
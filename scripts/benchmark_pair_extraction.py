@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark one-pass extract_trips_for_pairs against calling extract_trips
+once per (route, first_stop, last_stop) pair, and check each pair's trips
+are the same.
+
+Pairs come from stop_pairs: every route's end-to-end pair, or with
+--all-stops every ordered pair of its stops. Takes the same observation
+files as benchmark_trip_extraction.py, or a converted week (.jsonl.gz).
+
+Usage (from the repository root):
+    python -m scripts.benchmark_pair_extraction data/bus_19_history.json.gz --all-stops
+    python -m scripts.benchmark_pair_extraction v2/2021-W45.jsonl.gz --route 4 --route 19
+"""
+
+import argparse
+
+import pandas as pd
+
+from find_completed_routes import extract_trips, extract_trips_for_pairs, stop_pairs
+from scripts.benchmark_trip_extraction import load_observations, timed
+
+
+def extract_each(df, pairs):
+    """extract_trips for each pair in turn, as {pair: trips}."""
+    return {pair: extract_trips(df, *pair) for pair in pairs}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare one-pass multi-pair trip extraction with one pass per pair."
+    )
+    parser.add_argument("path", help="Observations JSON (TriMet or db4iot export) or converted week")
+    parser.add_argument("--route", type=int, action="append", dest="routes",
+                        help="Only this route's pairs (repeatable; default: all)")
+    parser.add_argument("--all-stops", action="store_true",
+                        help="Every ordered stop pair, not just each route's ends")
+    args = parser.parse_args()
+
+    df = load_observations(args.path)
+    pairs = [pair for pair in stop_pairs(df, args.routes, args.all_stops) if pair[1] != pair[2]]
+    each, each_s = timed(extract_each, df, pairs)
+    combined, combined_s = timed(extract_trips_for_pairs, df, pairs)
+
+    by_pair = dict(list(combined.groupby(['routeNumber', 'first_stop', 'last_stop'])))
+    for pair, trips in each.items():
+        got = by_pair.get(pair, combined.iloc[:0])
+        # Row order can only differ between trips starting at the same moment
+        pd.testing.assert_frame_equal(
+            got.sort_index(), trips.sort_index(), check_exact=False, rtol=1e-12, obj=f"pair {pair}",
+        )
+    print(f"{args.path}: {len(df)} observations, {len(pairs)} pairs, {len(combined)} trips (identical)")
+    print(f"  one pass per pair {each_s * 1000:8.0f} ms")
+    print(f"  one pass          {combined_s * 1000:8.0f} ms")
+    print(f"  speedup           {each_s / combined_s:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark duration percentiles from quantile sketches (quantile_sketch.py,
+trip_store.trip_sketches) against exact pandas quantiles.
+
+Trips are extracted for every stop pair of the observations. Sketches are
+built per (route, pair, weekday, hour) both in one go and per week, merged
+afterwards as parallel workers' would be. For each pair this reports how
+far the sketch's 5th/50th/95th percentiles are from the exact ones, as a
+share of the pair's trips ranked between them (KLL's error measure), and
+how many trips the outlier cut keeps with each.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_quantile_sketch data/bus_19_history.json.gz
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from find_completed_routes import extract_trips_for_pairs, finish_trips, stop_pairs
+from quantile_sketch import SketchTable
+from scripts.benchmark_trip_extraction import load_observations, timed
+from trip_store import TRIP_COLUMNS, trip_sketches
+
+QUANTILES = [0.05, 0.5, 0.95]
+
+
+def weekly_sketches(trips: pd.DataFrame) -> SketchTable:
+    """trip_sketches of each week of trips, merged."""
+    sketches = SketchTable()
+    for _, week in trips.groupby(trips.trip_start.dt.to_period('W')):
+        sketches.merge(trip_sketches(week))
+    return sketches
+
+
+def rank_errors(trips: pd.DataFrame, sketches: SketchTable) -> np.ndarray:
+    """Per pair & quantile, |rank of sketch quantile - q| as a share of the pair's trips."""
+    errors = []
+    for (route_number, first_stop, last_stop), pair in trips.groupby(['routeNumber', 'first_stop', 'last_stop']):
+        minutes = np.sort(pair.duration.to_numpy() / np.timedelta64(1, 'm'))
+        estimates = sketches.merged(route_number, first_stop, last_stop).quantiles(QUANTILES)
+        ranks = np.searchsorted(minutes, estimates) / len(minutes)
+        errors.append(np.abs(ranks - QUANTILES))
+    return np.array(errors)
+
+
+def sketch_cut(trips: pd.DataFrame, sketches: SketchTable, q: float) -> pd.DataFrame:
+    """The trips below their pair's q quantile as the sketches estimate it."""
+    key = ['routeNumber', 'first_stop', 'last_stop']
+    cutoff = trips.groupby(key).duration.transform(
+        lambda pair: sketches.merged(*pair.name).quantile(q))
+    return trips[trips.duration / pd.Timedelta(minutes=1) < cutoff]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare sketched and exact trip duration percentiles."
+    )
+    parser.add_argument("path", help="Observations JSON (TriMet or db4iot export) or converted week")
+    parser.add_argument("--route", type=int, action="append", dest="routes",
+                        help="Only this route's stops (repeatable; default: all)")
+    args = parser.parse_args()
+
+    df = load_observations(args.path)
+    pairs = stop_pairs(df, args.routes, all_stops=True)
+    trips = extract_trips_for_pairs(df, pairs, outlier_quantile=None).reset_index(drop=True)
+
+    sketches, build_s = timed(trip_sketches, trips)
+    weekly, weekly_s = timed(weekly_sketches, trips)
+    key = ['routeNumber', 'first_stop', 'last_stop']
+    _, exact_s = timed(lambda: trips.groupby(key).duration.quantile(QUANTILES))
+
+    pair = trips.groupby(key, sort=False).ngroup().to_numpy()
+    exact_cut, exact_cut_s = timed(finish_trips, trips[TRIP_COLUMNS], pair)
+    sketch_kept, sketch_cut_s = timed(sketch_cut, trips, sketches, 0.95)
+
+    print(f"{args.path}: {len(trips)} trips, {len(pairs)} stop pairs, {len(sketches)} sketches "
+          f"holding {sum(s.size for s in sketches.sketches.values())} values")
+    print(f"  exact quantiles        {exact_s * 1000:8.0f} ms")
+    print(f"  build sketches         {build_s * 1000:8.0f} ms")
+    print(f"  build weekly & merge   {weekly_s * 1000:8.0f} ms")
+    for name, table in [("one pass", sketches), ("weekly merged", weekly)]:
+        errors = rank_errors(trips, table)
+        print(f"  {name:14} rank error of p5/p50/p95: mean "
+              + " / ".join(f"{e:.2%}" for e in errors.mean(axis=0))
+              + ", max " + " / ".join(f"{e:.2%}" for e in errors.max(axis=0)))
+    shared = len(exact_cut.index.intersection(sketch_kept.index))
+    print(f"  outlier cut (p95): exact keeps {len(exact_cut)} in {exact_cut_s * 1000:.0f} ms, "
+          f"sketch keeps {len(sketch_kept)} in {sketch_cut_s * 1000:.0f} ms, {shared} in both")
+
+
+if __name__ == "__main__":
+    main()
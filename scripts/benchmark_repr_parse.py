@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Benchmark parsing a Python repr snapshot with ast.literal_eval vs repr_to_json.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_repr_parse data/bustimes__2018-08-03__03-06-51.json
+"""
+
+import argparse
+import ast
+import json
+import time
+
+from scripts.convert_bustimes import repr_to_json
+
+
+def time_per_call(fn, raw: str, repeat: int) -> float:
+    """Return the best-of-three mean seconds per call of fn(raw)."""
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            fn(raw)
+        best = min(best, (time.perf_counter() - t0) / repeat)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare ast.literal_eval with the repr-to-JSON translator."
+    )
+    parser.add_argument("paths", nargs="+", help="Python repr snapshot files")
+    parser.add_argument(
+        "--repeat", type=int, default=20,
+        help="Calls per timing run (default: 20)",
+    )
+    args = parser.parse_args()
+
+    for path in args.paths:
+        with open(path, "r") as f:
+            raw = f.read()
+
+        expected = ast.literal_eval(raw)
+        translated = json.loads(repr_to_json(raw))
+        assert translated == expected, f"{path}: translator output differs from literal_eval"
+
+        literal = time_per_call(ast.literal_eval, raw, args.repeat)
+        fast = time_per_call(lambda r: json.loads(repr_to_json(r)), raw, args.repeat)
+        print(f"{path}: {len(raw) / 1024:.0f} KB, {len(expected)} records")
+        print(f"  ast.literal_eval        {literal * 1000:8.2f} ms")
+        print(f"  repr_to_json+json.loads {fast * 1000:8.2f} ms")
+        print(f"  speedup                 {literal / fast:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark the boto3 thread pool against the async AIMD fetcher for S3 GETs.
+
+Both fetch the same keys and report objects/s and MB/s; the async fetcher
+also reports where its adaptive concurrency ended up and how often it was
+throttled. Point it at S3 itself, or at an S3-compatible stand-in (moto,
+MinIO) with --endpoint-url; --serve-moto starts a local moto server and
+fills it with copies of a sample snapshot first.
+
+Usage (from the repository root):
+    # Local stand-in (needs moto[server] and aiohttp)
+    python -m scripts.benchmark_s3_fetch --serve-moto data/bustimes__2018-08-03__03-06-51.json --objects 2000
+
+    # Real bucket, one week's keys
+    python -m scripts.benchmark_s3_fetch --week 2021-W45 --limit 1000 --workers 64
+"""
+
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from scripts.convert_bustimes import (
+    S3_BUCKET,
+    AsyncS3Fetcher,
+    list_s3_keys_for_weeks,
+    make_s3_client,
+    read_s3_file,
+)
+
+
+def serve_moto(sample_path: str, objects: int, port: int) -> list[str]:
+    """Start a moto server holding `objects` copies of a snapshot; return their keys."""
+    import boto3
+    from moto.server import ThreadedMotoServer
+
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(name, "test")
+    os.environ["AWS_ENDPOINT_URL"] = f"http://127.0.0.1:{port}"
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # one line per GET otherwise
+    ThreadedMotoServer(port=port, verbose=False).start()
+
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket=S3_BUCKET)
+    with open(sample_path, "rb") as f:
+        body = f.read()
+    keys = []
+    for i in range(objects):
+        minute = f"{i // 60 % 24:02d}-{i % 60:02d}-00"
+        key = f"raw/bustimes__2018-08-{1 + i // 1440:02d}__{minute}.json"
+        # Public like the real bucket, so unsigned GETs work
+        s3.put_object(Bucket=S3_BUCKET, Key=key, Body=body, ACL="public-read")
+        keys.append(key)
+    return keys
+
+
+def report(name: str, seconds: float, count: int, size: int, extra: str = ""):
+    print(f"  {name:8} {count / seconds:8.0f} objects/s {size / 1e6 / seconds:8.1f} MB/s  {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare threaded boto3 GETs with the async AIMD fetcher."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--week", help="Fetch this ISO week's keys from the bucket")
+    source.add_argument("--serve-moto", metavar="SAMPLE", help="Serve copies of SAMPLE from local moto")
+    parser.add_argument("--objects", type=int, default=1000, help="Objects for --serve-moto (default: 1000)")
+    parser.add_argument("--port", type=int, default=5055, help="Port for --serve-moto (default: 5055)")
+    parser.add_argument("--endpoint-url", help="S3-compatible endpoint (default: AWS_ENDPOINT_URL or S3)")
+    parser.add_argument("--limit", type=int, default=1000, help="Keys to fetch (default: 1000)")
+    parser.add_argument("--workers", type=int, default=16, help="boto3 threads (default: 16)")
+    parser.add_argument(
+        "--max-concurrency", type=int, default=256,
+        help="Ceiling for the async fetcher's adaptive limit (default: 256)",
+    )
+    args = parser.parse_args()
+
+    if args.endpoint_url:
+        os.environ["AWS_ENDPOINT_URL"] = args.endpoint_url
+    if args.serve_moto:
+        keys = serve_moto(args.serve_moto, args.objects, args.port)
+    else:
+        keys = list_s3_keys_for_weeks(make_s3_client(), [args.week]).get(args.week, [])
+    keys = keys[:args.limit]
+    print(f"Fetching {len(keys)} objects from {os.environ.get('AWS_ENDPOINT_URL', 'S3')}")
+
+    s3_client = make_s3_client()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        size = sum(len(body) for body in pool.map(lambda key: read_s3_file(s3_client, key), keys))
+    report("threads", time.perf_counter() - t0, len(keys), size, f"({args.workers} workers)")
+
+    with AsyncS3Fetcher(max_concurrency=args.max_concurrency) as fetcher:
+        t0 = time.perf_counter()
+        size = sum(len(future.result()) for future in [fetcher.submit(key) for key in keys])
+        elapsed = time.perf_counter() - t0
+        stats = fetcher.stats()
+    report(
+        "async", elapsed, len(keys), size,
+        f"(concurrency {stats['limit']}, peak {stats['peak_limit']}, "
+        f"{stats['throttled']} throttled of {stats['requests']} GETs)",
+    )
+
+
+if __name__ == "__main__":
+    main()
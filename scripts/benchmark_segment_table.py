@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Benchmark stop-to-stop queries on a segment table (find_completed_routes
+segment_tables / stop_to_stop) against extracting each stop pair from the
+observations with extract_trips_for_pairs.
+
+The two define trips slightly differently: the table follows one tripID
+from stop to stop, extract_trips follows a vehicle from leaving one stop
+to leaving the other. So instead of asserting parity, this reports the
+share of extract_trips' trips the table has with the same start and
+duration.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_segment_table data/bus_19_history.json.gz
+"""
+
+import argparse
+
+from find_completed_routes import (
+    extract_trips_for_pairs,
+    segment_tables,
+    stop_pairs,
+    stop_to_stop,
+)
+from scripts.benchmark_trip_extraction import load_observations, timed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare segment-table stop-to-stop queries with re-extracting each pair."
+    )
+    parser.add_argument("path", help="Observations JSON (TriMet or db4iot export) or converted week")
+    parser.add_argument("--route", type=int, action="append", dest="routes",
+                        help="Only this route's stops (repeatable; default: all)")
+    args = parser.parse_args()
+
+    df = load_observations(args.path)
+    pairs = stop_pairs(df, args.routes, all_stops=True)
+    tables, build_s = timed(segment_tables, df)
+
+    query_s = extract_s = 0.0
+    matched = total = 0
+    for route_number, first_stop, last_stop in pairs:
+        table = tables[route_number]
+        segments, seconds = timed(stop_to_stop, table, first_stop, last_stop)
+        query_s += seconds
+        trips, seconds = timed(extract_trips_for_pairs, df, [(route_number, first_stop, last_stop)], None)
+        extract_s += seconds
+        keys = ["vehicleID", "trip_start", "duration"]
+        matched += len(trips[keys].merge(segments[keys], on=keys))
+        total += len(trips)
+
+    print(f"{args.path}: {len(df)} observations, {len(pairs)} stop pairs, "
+          f"{sum(len(t['stop_id']) for t in tables.values())} table entries")
+    print(f"  build segment tables   {build_s * 1000:8.0f} ms")
+    print(f"  query every pair       {query_s * 1000:8.0f} ms")
+    print(f"  re-extract every pair  {extract_s * 1000:8.0f} ms")
+    print(f"  same trip & duration   {matched / max(total, 1):8.1%} of {total} extracted trips")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark find_completed_routes' vectorized extract_trips against the
+original row-wise apply version, and check they find the same trips.
+
+Accepts TriMet-shaped JSON (vehicleID, time in ms, latitude/longitude) or
+the db4iot export in data/ (vehicle_id, event_timestamp in s,
+vehicle_location_*), which is renamed to the TriMet fields first.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_trip_extraction data/bus_19_history.json.gz
+"""
+
+import argparse
+import time
+
+import pandas as pd
+
+from find_completed_routes import (
+    TRIP_COLUMNS,
+    extract_trips,
+    get_datetime,
+    get_distance,
+    get_situation,
+)
+
+# db4iot export column -> TriMet field the extraction reads
+DB4IOT_COLUMNS = {
+    "vehicle_id": "vehicleID",
+    "vehicle_location_latitude": "latitude",
+    "vehicle_location_longitude": "longitude",
+}
+
+
+def load_observations(path: str) -> pd.DataFrame:
+    """Read vehicle observations, renaming db4iot columns to TriMet ones."""
+    df = pd.read_json(path, lines=".jsonl" in path)
+    if "vehicle_id" in df.columns:
+        df = df.rename(columns=DB4IOT_COLUMNS)
+        df["time"] = df["event_timestamp"] * 1000
+    return df
+
+
+def extract_trips_rowwise(df, bus_line=19, first_stop=1545, last_stop=792):
+    """
+    find_completed_routes.extract_trips row by row with DataFrame.apply,
+    as it was originally written: the reference it is checked against.
+    """
+    df = df[df['routeNumber'] == bus_line].copy()
+    df['first_stop'] = first_stop
+    df['last_stop'] = last_stop
+
+    df['event_timestamp'] = df.time.apply(get_datetime)
+    df['situation'] = df.apply(get_situation, args=[first_stop, last_stop], axis=1)
+
+    # Get only data points right after the bus leaves a stop (first or last stop)
+    leavings = df[df.situation.str.contains('leaving')]
+
+    def stats_for_vehicle_groups(df):
+        df = df.sort_values('event_timestamp')
+
+        # Save only the rows where the situation/state changed (approaching => leaving)
+        state_changes = (df != df.shift(1)).situation
+        vroutes = df.loc[state_changes].copy()
+
+        previous_rows = vroutes.shift(1)
+
+        # Save the start time, end time & duration of each trip
+        vroutes['trip_start'] = previous_rows.event_timestamp # Time leaving first stop
+        vroutes['trip_end'] = vroutes.event_timestamp # Time leaving last stop
+        vroutes['duration'] = vroutes.trip_end - vroutes.trip_start
+
+        vroutes['delay_start'] = previous_rows.delay
+        vroutes['delay_end'] = vroutes.delay
+
+        # Save the block ID for the start and end of each trip
+        # These should always be the same, otherwise something is wrong
+        # with that data point.
+        vroutes['block_start'] = previous_rows.blockID.astype('str')
+        vroutes['block_end'] = vroutes.blockID.astype('str')
+
+        # Calculte the distance between each start and and point
+        # This should help validate data as well
+        vroutes['lat_start'] = previous_rows.latitude
+        vroutes['lon_start'] = previous_rows.longitude
+        vroutes['lat_end'] = vroutes.latitude
+        vroutes['lon_end'] = vroutes.longitude
+        vroutes['distance'] = vroutes.apply(get_distance, axis=1)
+
+        # Only keep the "ending" data points for each trip
+        completed_routes = vroutes[vroutes.situation.str.contains('last')]
+
+        # Only keep columns we are interested in, and order them
+        return completed_routes[TRIP_COLUMNS]
+
+    # Grouping by the column's values (not the column) keeps vehicleID in each group
+    routes = leavings.groupby(leavings.vehicleID.to_numpy(), group_keys=False).apply(stats_for_vehicle_groups)
+
+    # Drop rows with NA durations
+    routes = routes.dropna()
+
+    # Drop outliers
+    # about 50 out of 4000 are over 100 minutes
+    # These are generally over 4 hours or event multiple days
+    routes = routes[routes.duration < routes.duration.quantile(0.95)].copy()
+
+    # Add new columns for grouping & aggregating
+    routes['weekday'] = routes.trip_start.apply(
+            lambda t: t.strftime('%A'))
+    routes['hour'] = routes.trip_start.apply(
+            lambda t: t.hour)
+    routes['weekday_num'] = routes.trip_start.apply(
+            lambda t: t.weekday())
+    routes['trip_start_time'] = routes.trip_start.dt.time
+    routes['time_of_day'] = routes.trip_start.apply(
+            lambda t: t.strftime('%H%M%S')).astype('int')
+    routes['duration_minutes'] = routes.duration.apply(
+            lambda t: t.seconds/60.0)
+
+    # Sort
+    return routes.sort_values('trip_start')
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare vectorized and row-wise completed-trip extraction."
+    )
+    parser.add_argument("path", help="Observations JSON (TriMet or db4iot export)")
+    parser.add_argument("--route", type=int, default=19, help="Route number (default: 19)")
+    parser.add_argument("--first-stop", type=int, default=1545, help="Origin stop (default: 1545)")
+    parser.add_argument("--last-stop", type=int, default=792, help="Destination stop (default: 792)")
+    args = parser.parse_args()
+
+    df = load_observations(args.path)
+    pair = dict(bus_line=args.route, first_stop=args.first_stop, last_stop=args.last_stop)
+    rowwise, rowwise_s = timed(extract_trips_rowwise, df, **pair)
+    vectorized, vectorized_s = timed(extract_trips, df, **pair)
+
+    # Row order can only differ between trips starting at the same moment
+    pd.testing.assert_frame_equal(
+        vectorized.sort_index(), rowwise.sort_index(), check_exact=False, rtol=1e-12,
+    )
+    print(f"{args.path}: {len(df)} observations, {len(vectorized)} trips (identical)")
+    print(f"  row-wise apply {rowwise_s * 1000:8.0f} ms")
+    print(f"  vectorized     {vectorized_s * 1000:8.0f} ms")
+    print(f"  speedup        {rowwise_s / vectorized_s:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark loading a route's trips from the columnar trip store
+(trip_store.py) against the pickled DataFrame it replaces, and check the
+store gives back the same trips.
+
+Trips are extracted for every stop pair of the observations, then copied
+--copies times, each copy a year later, to stand in for a long history.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_trip_store data/bus_19_history.json.gz --copies 50
+"""
+
+import argparse
+import os
+import tempfile
+
+import pandas as pd
+
+from find_completed_routes import extract_trips_for_pairs, stop_pairs
+from scripts.benchmark_trip_extraction import load_observations, timed
+from trip_store import TRIP_FRAME_COLUMNS, read_trips, write_trips
+
+
+def long_history(trips: pd.DataFrame, copies: int) -> pd.DataFrame:
+    """`copies` copies of trips, the n-th shifted n years (52 weeks) later."""
+    shifted = []
+    for n in range(copies):
+        offset = pd.Timedelta(weeks=52 * n)
+        shifted.append(trips.assign(trip_start=trips.trip_start + offset, trip_end=trips.trip_end + offset))
+    return pd.concat(shifted, ignore_index=True).sort_values('trip_start', kind='stable')
+
+
+def same_values(stored: pd.DataFrame, trips: pd.DataFrame) -> bool:
+    """Compare column by column, allowing the store's narrower types."""
+    for name in trips.columns:
+        a, b = stored[name], trips[name]
+        if isinstance(a.dtype, pd.CategoricalDtype):
+            a, b = a.astype(str), b.astype(str)
+        elif a.dtype.kind in 'mM':
+            a = a.astype(b.dtype)
+        if not (a.to_numpy() == b.to_numpy()).all():
+            print(f"  column {name} differs")
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare loading trips from the trip store and from a pickle."
+    )
+    parser.add_argument("path", help="Observations JSON (TriMet or db4iot export) or converted week")
+    parser.add_argument("--copies", type=int, default=20, help="Years of trips to make (default: 20)")
+    args = parser.parse_args()
+
+    df = load_observations(args.path)
+    trips = extract_trips_for_pairs(df, stop_pairs(df, all_stops=True))
+    trips = long_history(trips[trips.routeNumber == trips.routeNumber.iloc[0]], args.copies)
+    route_number = int(trips.routeNumber.iloc[0])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_path = os.path.join(tmp, "trips.pickle")
+        _, pickle_write_s = timed(trips.to_pickle, pickle_path)
+        _, store_write_s = timed(write_trips, trips, tmp)
+
+        pickled, pickle_s = timed(pd.read_pickle, pickle_path)
+        stored, store_s = timed(read_trips, tmp, route_number)
+        chart, chart_s = timed(read_trips, tmp, route_number, ["trip_start", "duration_minutes", "hour"])
+        everything = read_trips(tmp, route_number, TRIP_FRAME_COLUMNS)
+
+        if not same_values(everything.reset_index(drop=True), pickled.reset_index(drop=True)):
+            raise SystemExit("trip store does not match the pickle")
+        pickle_mb = os.path.getsize(pickle_path) / 1e6
+        store_mb = sum(
+            os.path.getsize(os.path.join(tmp, f"route={route_number}", name))
+            for name in os.listdir(os.path.join(tmp, f"route={route_number}"))
+        ) / 1e6
+
+    print(f"{len(trips)} trips of route {route_number} (identical)")
+    print(f"  pickle      {pickle_mb:7.1f} MB  write {pickle_write_s * 1000:7.0f} ms  load {pickle_s * 1000:7.1f} ms")
+    print(f"  trip store  {store_mb:7.1f} MB  write {store_write_s * 1000:7.0f} ms  load {store_s * 1000:7.1f} ms")
+    print(f"  trip store, 3 chart columns                        load {chart_s * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
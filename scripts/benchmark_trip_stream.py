@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark streaming trip extraction (find_completed_routes.stream_trips)
+against loading the same archive window into one DataFrame for
+extract_trips_for_pairs, and check both find the same trips.
+
+Reports the time and the peak Python memory (tracemalloc) of each: the
+DataFrame path grows with the window, the stream only with the number of
+vehicles on a trip. With --workers, the stream is also run with weeks
+extracted in a process pool and stitched, and must match the serial one.
+
+Usage (from the repository root):
+    python -m scripts.benchmark_trip_stream v2 --start 2021-11-01 --end 2021-11-15 --pair 19:1545:792
+    python -m scripts.benchmark_trip_stream v2 --start 2021-01-01 --workers 8
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+
+from bustimes_reader import read_dataframes
+from find_completed_routes import (
+    STREAM_COLUMNS,
+    extract_trips_for_pairs,
+    stream_trips,
+    trips_dataframe,
+)
+from scripts.benchmark_trip_extraction import timed
+
+
+def measured(fn, *args):
+    """Run fn(*args); return its result, seconds and peak traced MB."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def in_memory(archive_dir, pairs, start, end):
+    routes = {route_number for route_number, _, _ in pairs}
+    df = pd.concat(read_dataframes(archive_dir, start, end, routes=routes, columns=STREAM_COLUMNS),
+                   ignore_index=True)
+    return extract_trips_for_pairs(df, pairs, outlier_quantile=None)
+
+
+def streamed(archive_dir, pairs, start, end, workers=1):
+    return trips_dataframe(stream_trips(archive_dir, pairs, start, end, workers), outlier_quantile=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare streaming and in-memory trip extraction over an archive window."
+    )
+    parser.add_argument("archive_dir", help="Directory of converted weeks, e.g. v2")
+    parser.add_argument("--start", help="First snapshot time (UTC), e.g. 2021-11-08")
+    parser.add_argument("--end", help="Snapshot time (UTC) to stop before")
+    parser.add_argument("--pair", action="append", dest="pairs", metavar="ROUTE:FIRST:LAST",
+                        help="Route & stop pair (repeatable; default 19:1545:792)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Also stream with weeks extracted by this many processes")
+    args = parser.parse_args()
+
+    pairs = [tuple(int(x) for x in pair.split(":")) for pair in args.pairs or ["19:1545:792"]]
+    window = (args.archive_dir, pairs, args.start, args.end)
+    batch, batch_s, batch_mb = measured(in_memory, *window)
+    stream, stream_s, stream_mb = measured(streamed, *window)
+
+    # Both keep every trip; order them the same way before comparing
+    key = ["routeNumber", "first_stop", "last_stop", "vehicleID", "trip_start"]
+    pd.testing.assert_frame_equal(
+        stream.sort_values(key).reset_index(drop=True),
+        batch.sort_values(key).reset_index(drop=True),
+        check_dtype=False, check_exact=False, rtol=1e-12,
+    )
+    print(f"{args.archive_dir}: {len(pairs)} pairs, {len(stream)} trips (identical)")
+    print(f"  DataFrame {batch_s:8.1f} s {batch_mb:8.1f} MB peak")
+    print(f"  stream    {stream_s:8.1f} s {stream_mb:8.1f} MB peak")
+
+    if args.workers > 1:
+        # Timed without tracemalloc, which slows the serial run down
+        serial_s = timed(streamed, *window)[1]
+        parallel, parallel_s = timed(streamed, *window, args.workers)
+        pd.testing.assert_frame_equal(parallel, stream)
+        print(f"  serial    {serial_s:8.1f} s")
+        print(f"  {args.workers} workers {parallel_s:8.1f} s (identical, {serial_s / parallel_s:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
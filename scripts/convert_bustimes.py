@@ -12,21 +12,47 @@ Usage:
     # All weeks from S3
     python scripts/convert_bustimes.py --all --output-dir data/output
 
+    # Typed columnar output instead of JSONL (needs pyarrow)
+    python scripts/convert_bustimes.py --weeks 2021-W45 --format parquet --output-dir data/output
+
+    # One file per route per week: data/output/route=19/week=2021-W45.jsonl.gz
+    python scripts/convert_bustimes.py --weeks 2021-W45 --partition-by route --output-dir data/output
+
+    # zstd instead of gzip, with a dictionary trained by benchmark_compression.py
+    python scripts/convert_bustimes.py --weeks 2021-W45 --compression zstd --zstd-dict bustimes.zdict --output-dir data/output
+
+    # Check converted weeks against their .manifest.json without decompressing
+    python scripts/convert_bustimes.py --verify --output-dir data/output
+
     # Dry run (list files, don't convert)
     python scripts/convert_bustimes.py --all --dry-run --local-dir data/test_local
+
+    # Cache the bucket listing locally; later runs only list new keys
+    python scripts/convert_bustimes.py --all --manifest keys.sqlite --output-dir data/output
+    python scripts/convert_bustimes.py --all --manifest keys.sqlite --refresh-manifest --dry-run
 """
 
 import argparse
 import ast
+import asyncio
+import contextlib
 import datetime
 import gzip
+import io
+import itertools
 import json
 import os
+import platform
+import random
 import re
+import resource
+import sqlite3
 import sys
+import threading
 import time
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import zlib
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 # Files at or before this key use Python repr format, not JSON
 LAST_MALFORMED_KEY = "raw/bustimes__2021-11-10__07-15-05.json"
@@ -38,6 +64,9 @@ FILENAME_RE = re.compile(
 S3_BUCKET = "bustimes-data"
 S3_PREFIX = "raw/"
 
+# Downloaded-but-unwritten bytes allowed per week before fetching pauses
+DEFAULT_MAX_INFLIGHT_BYTES = 256 * 1024 * 1024
+
 
 def parse_filename_dt(key: str) -> datetime.datetime | None:
     """Extract UTC datetime from a bustimes S3 key or local filename."""
@@ -67,21 +96,162 @@ def is_malformed(key: str) -> bool:
     return key <= LAST_MALFORMED_KEY
 
 
+# --- Python repr translation ------------------------------------------------
+
+# One token of the Python 2 repr dialect that needs rewriting for JSON:
+# a u'...' or u"..." string, a None/True/False keyword, or an L-suffixed long
+REPR_TOKEN_RE = re.compile(
+    r"""u?'((?:[^'\\]|\\.)*)'"""
+    r'''|u?"((?:[^"\\]|\\.)*)"'''
+    r"|(None|True|False)\b"
+    r"|(-?\d+)L\b"
+)
+REPR_ESCAPE_RE = re.compile(r'\\(x[0-9a-fA-F]{2}|U[0-9a-fA-F]{8}|.)|"', re.DOTALL)
+REPR_KEYWORDS = {"None": "null", "True": "true", "False": "false"}
+
+
+def _translate_escape(m: re.Match) -> str:
+    esc = m.group(1)
+    if esc is None:
+        return '\\"'  # bare double quote inside a single-quoted string
+    if esc[0] == "x":
+        return "\\u00" + esc[1:]
+    if esc[0] == "U":
+        return json.dumps(chr(int(esc[1:], 16)))[1:-1]
+    if esc == "'":
+        return "'"
+    if esc in '\\"nrtbfu':
+        return "\\" + esc
+    raise ValueError(f"unsupported escape \\{esc}")
+
+
+def _translate_token(m: re.Match) -> str:
+    string = m.group(1)
+    if string is None:
+        string = m.group(2)
+    if string is not None:
+        if "\\" in string or '"' in string:
+            string = REPR_ESCAPE_RE.sub(_translate_escape, string)
+        return '"' + string + '"'
+    if m.group(3) is not None:
+        return REPR_KEYWORDS[m.group(3)]
+    return m.group(4)
+
+
+def repr_to_json(raw: str) -> str:
+    """Rewrite the Python 2 repr written by save_to_s3 as JSON text.
+
+    Handles the dialect that `bytes(bus_data)` produced: u'...' strings,
+    None/True/False and L-suffixed longs. Anything else is left untouched, so
+    json.loads rejects it and the caller can fall back to literal_eval.
+    """
+    if "\\" in raw or '"' in raw or "\0" in raw:
+        return REPR_TOKEN_RE.sub(_translate_token, raw)
+
+    # Fast path: with no escapes or double quotes, every ' is a string
+    # delimiter, so the text splits into alternating outside/string parts
+    # and only the outside parts need rewriting.
+    parts = raw.split("'")
+    outside = "\0".join(parts[0::2])
+    outside = outside.replace("u\0", "\0")
+    for keyword, literal in REPR_KEYWORDS.items():
+        outside = outside.replace(keyword, literal)
+    outside = outside.replace("L", "")
+    parts[0::2] = outside.split("\0")
+    return '"'.join(parts)
+
+
+def parse_repr(raw: str) -> list[dict]:
+    """Parse a Python repr file body, falling back to literal_eval."""
+    try:
+        return json.loads(repr_to_json(raw))
+    except ValueError:
+        return ast.literal_eval(raw)
+
+
 def parse_records(raw: str, key: str) -> list[dict]:
     """Parse a raw file body into a list of dicts."""
     if is_malformed(key):
-        return ast.literal_eval(raw)
+        return parse_repr(raw)
     else:
         return json.loads(raw)
 
 
+# json.dumps builds a new encoder per call when given separators; reuse one
+JSONL_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+def encode_records(records: list[dict], snapshot_dt: datetime.datetime, fmt: str = "jsonl"):
+    """Serialize one snapshot's records as JSONL bytes or an Arrow RecordBatch."""
+    if fmt == "parquet":
+        return records_to_batch(records, snapshot_dt)
+    if not records:
+        return b""
+    snapshot_time = snapshot_dt.isoformat()
+    # Each line is the record's JSON with snapshot_time appended as the last
+    # key. Encode the whole list in one C call and turn the "},{" between
+    # records into that suffix plus a newline, leaving the dicts untouched.
+    # A "},{" inside a value (nested objects, strings) or a record that is
+    # empty or already has snapshot_time needs the per-record path.
+    suffix = ',"snapshot_time":' + JSONL_ENCODER.encode(snapshot_time) + "}\n"
+    body = JSONL_ENCODER.encode(records)
+    if body.count("},{") == len(records) - 1 and all(
+        record and "snapshot_time" not in record for record in records
+    ):
+        return (body[1:-2].replace("},{", suffix + "{") + suffix).encode("utf-8")
+    lines = [
+        JSONL_ENCODER.encode({**record, "snapshot_time": snapshot_time}) + "\n"
+        for record in records
+    ]
+    return "".join(lines).encode("utf-8")
+
+
+def encode_file(
+    key: str, raw: str, fmt: str = "jsonl", partition_by: str | None = None,
+) -> tuple[str, object, int, str | None, tuple[float, float]]:
+    """Parse one raw file body and serialize it for the output format.
+
+    Runs in a parse worker process, so only picklable values cross the
+    process boundary. Returns (key, chunk, record_count, error, seconds),
+    where chunk is JSONL bytes for "jsonl" or an Arrow RecordBatch for
+    "parquet". With `partition_by`, chunk is instead a dict of partition
+    value -> (chunk, record_count). On a parse failure chunk is empty and
+    error holds the message. seconds is (parse, serialize) CPU time of the
+    calling thread, so GIL waits in fetch threads don't inflate it.
+    """
+    dt = parse_filename_dt(key)
+    assert dt is not None, f"could not parse datetime from {key}"
+    t0 = time.thread_time()
+    try:
+        records = parse_records(raw, key)
+        t1 = time.thread_time()
+        if partition_by is None:
+            chunk = encode_records(records, dt, fmt)
+        else:
+            field = PARTITION_FIELDS[partition_by]
+            groups: dict[str, list[dict]] = defaultdict(list)
+            for record in records:
+                groups[partition_value(record.get(field))].append(record)
+            chunk = {
+                value: (encode_records(group, dt, fmt), len(group))
+                for value, group in groups.items()
+            }
+        return key, chunk, len(records), None, (t1 - t0, time.thread_time() - t1)
+    except Exception as e:
+        return key, b"", 0, str(e), (time.thread_time() - t0, 0.0)
+
+
 # --- S3 client --------------------------------------------------------------
 
-def make_s3_client(profile: str | None = None):
-    """Create an S3 client, optionally using a named profile for auth."""
+def make_s3_client(profile: str | None = None, signed: bool = False):
+    """Create an S3 client, optionally using a named profile for auth.
+
+    Without a profile the client is anonymous, unless `signed` asks for the
+    default credential chain (needed to write).
+    """
     import boto3
 
-    if profile:
+    if profile or signed:
         session = boto3.Session(profile_name=profile)
         return session.client("s3")
     else:
@@ -91,6 +261,166 @@ def make_s3_client(profile: str | None = None):
         return boto3.client("s3", config=Config(signature_version=UNSIGNED))
 
 
+# --- S3 upload --------------------------------------------------------------
+
+# Multipart part size; S3 needs at least 5 MiB for every part but the last
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+
+# Parts uploading at once per object, so buffered output stays bounded
+MAX_PENDING_PARTS = 4
+
+
+def parse_s3_url(url: str) -> tuple[str, str]:
+    """Split "s3://bucket/prefix/" into (bucket, prefix)."""
+    if not url.startswith("s3://"):
+        raise ValueError(f"not an s3:// URL: {url}")
+    bucket, _, prefix = url[len("s3://"):].partition("/")
+    if prefix and not prefix.endswith("/"):
+        prefix += "/"
+    return bucket, prefix
+
+
+class S3MultipartWriter:
+    """Write-only binary stream that uploads to an S3 object as it is written.
+
+    Writes are cut into `part_size` parts, each uploaded as soon as it
+    fills; write() blocks while MAX_PENDING_PARTS are uploading, so at most
+    a few parts are held in memory. A failed part is raised by the next
+    write() that starts a part (or by close()), not only once the whole
+    object is written. close() uploads the last part; nothing is visible
+    in S3 until complete(), and abort() discards the parts already sent.
+    Output smaller than one part is sent by complete() as a single
+    PutObject instead.
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str, part_size: int = DEFAULT_PART_SIZE):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.closed = False
+        self._buffer = bytearray()
+        self._size = 0
+        self._upload_id = None
+        self._parts: list[Future] = []
+        self._pool = ThreadPoolExecutor(max_workers=MAX_PENDING_PARTS)
+        self._slots = threading.Semaphore(MAX_PENDING_PARTS)
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._size += len(data)
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _submit(self, body: bytes):
+        if self._upload_id is None:
+            self._upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key,
+            )["UploadId"]
+        self._slots.acquire()
+        try:
+            self._raise_failed_part()
+        except BaseException:
+            self._slots.release()
+            raise
+        future = self._pool.submit(self._upload_part, len(self._parts) + 1, body)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._parts.append(future)
+
+    def _raise_failed_part(self):
+        """Raise the error of the first part that failed to upload, if any."""
+        for future in self._parts:
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                raise future.exception()
+
+    def _upload_part(self, number: int, body: bytes) -> dict:
+        resp = self.s3_client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=number, Body=body,
+        )
+        return {"PartNumber": number, "ETag": resp["ETag"]}
+
+    def tell(self) -> int:
+        return self._size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """Upload the last part and wait for every part to finish."""
+        if self.closed:
+            return
+        self.closed = True
+        if self._upload_id is not None and self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        self._pool.shutdown()
+        self._raise_failed_part()
+
+    def complete(self):
+        """Make the object visible in S3 (close() first)."""
+        if self._upload_id is None:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            return
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            MultipartUpload={"Parts": [future.result() for future in self._parts]},
+        )
+
+    def abort(self):
+        """Discard the upload; S3 frees the parts already sent."""
+        self.closed = True
+        self._pool.shutdown(cancel_futures=True)
+        if self._upload_id is not None:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            )
+            self._upload_id = None
+
+
+class S3Destination:
+    """Where converted outputs are uploaded instead of kept under `local_dir`.
+
+    An output's key is its path relative to `local_dir`, under the URL's
+    prefix. Small sidecars (block index, manifest, repeats) are still
+    written under `local_dir` first and moved up by upload_file().
+    """
+
+    def __init__(self, s3_client, url: str, local_dir: str, part_size: int = DEFAULT_PART_SIZE):
+        self.s3_client = s3_client
+        self.bucket, self.prefix = parse_s3_url(url)
+        self.local_dir = local_dir
+        self.part_size = part_size
+
+    def key_for(self, path: str) -> str:
+        return self.prefix + os.path.relpath(path, self.local_dir).replace(os.sep, "/")
+
+    def url_for(self, path: str) -> str:
+        return f"s3://{self.bucket}/{self.key_for(path)}"
+
+    def exists(self, path: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self.s3_client.head_object(Bucket=self.bucket, Key=self.key_for(path))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    def open(self, path: str) -> S3MultipartWriter:
+        return S3MultipartWriter(self.s3_client, self.bucket, self.key_for(path), self.part_size)
+
+    def upload_file(self, path: str, remove: bool = True):
+        """Upload a local file to its key, then delete it unless `remove` is False."""
+        self.s3_client.upload_file(path, self.bucket, self.key_for(path))
+        if remove:
+            os.remove(path)
+
+
 # --- File listing -----------------------------------------------------------
 
 def list_local_files(local_dir: str) -> list[str]:
@@ -159,6 +489,124 @@ def list_s3_keys_all(s3_client) -> list[str]:
     return keys
 
 
+# --- Key manifest -----------------------------------------------------------
+
+# Local SQLite cache of the bucket listing plus the weeks already converted,
+# so restarts don't re-list 4.8M objects or depend on local output files
+# (which the sync loop deletes once uploaded).
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    etag TEXT NOT NULL,
+    week TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS objects_week ON objects (week, key);
+CREATE TABLE IF NOT EXISTS converted_weeks (
+    week TEXT NOT NULL,
+    output TEXT NOT NULL,
+    files INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    errors INTEGER NOT NULL,
+    converted_at TEXT NOT NULL,
+    PRIMARY KEY (week, output)
+);
+"""
+
+# Source key prefixes, listed separately: root-level keys are the pre-raw era
+SOURCE_PREFIXES = [S3_PREFIX, "bustimes__"]
+
+
+def open_manifest(path: str) -> sqlite3.Connection:
+    """Open (creating if needed) the key manifest at path."""
+    conn = sqlite3.connect(path)
+    conn.executescript(MANIFEST_SCHEMA)
+    return conn
+
+
+def update_manifest(conn: sqlite3.Connection, s3_client) -> int:
+    """Add keys listed after the last known key under each prefix.
+
+    Keys are timestamped, so new objects always sort after the last one we
+    have and S3 only has to list the tail (StartAfter). Commits per page, so
+    an interrupted initial build resumes where it stopped. Returns the number
+    of keys added.
+    """
+    added = 0
+    for prefix in SOURCE_PREFIXES:
+        # Range query rather than LIKE, which would treat "_" as a wildcard
+        prefix_end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        (last_key,) = conn.execute(
+            "SELECT max(key) FROM objects WHERE key >= ? AND key < ?",
+            (prefix, prefix_end),
+        ).fetchone()
+        params = {"Bucket": S3_BUCKET, "Prefix": prefix}
+        if last_key:
+            params["StartAfter"] = last_key
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(**params):
+            rows = []
+            for obj in page.get("Contents", []):
+                dt = parse_filename_dt(obj["Key"])
+                if dt:
+                    rows.append((obj["Key"], obj["Size"], obj["ETag"].strip('"'), iso_week_label(dt)))
+            conn.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?)", rows)
+            conn.commit()
+            if added // 100000 != (added + len(rows)) // 100000:
+                print(f"  ...added {added + len(rows)} keys so far", flush=True)
+            added += len(rows)
+    return added
+
+
+def manifest_key_count(conn: sqlite3.Connection) -> int:
+    (count,) = conn.execute("SELECT count(*) FROM objects").fetchone()
+    return count
+
+
+def manifest_keys_by_week(
+    conn: sqlite3.Connection, week_strs: list[str] | None = None,
+) -> dict[str, list[str]]:
+    """Return manifest keys grouped by week (all weeks, or just week_strs)."""
+    if week_strs is None:
+        rows = conn.execute("SELECT week, key FROM objects ORDER BY week, key")
+    else:
+        placeholders = ",".join("?" * len(week_strs))
+        rows = conn.execute(
+            f"SELECT week, key FROM objects WHERE week IN ({placeholders}) ORDER BY week, key",
+            week_strs,
+        )
+    weeks: dict[str, list[str]] = {}
+    for week, key in rows:
+        weeks.setdefault(week, []).append(key)
+    return weeks
+
+
+def output_id(output: str) -> str:
+    """Return how the manifest names an output: its s3:// URL or absolute path."""
+    return output if output.startswith("s3://") else os.path.abspath(output)
+
+
+def converted_outputs(conn: sqlite3.Connection) -> set[str]:
+    """Return the outputs (see output_id) the manifest records as converted."""
+    return {output for (output,) in conn.execute("SELECT output FROM converted_weeks")}
+
+
+def mark_week_converted(conn: sqlite3.Connection, stats: dict):
+    """Record a finished week so later runs skip it even if its file is gone."""
+    conn.execute(
+        "INSERT OR REPLACE INTO converted_weeks VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            stats["week"],
+            output_id(stats["output"]),
+            stats["files"],
+            stats["records"],
+            stats["errors"],
+            datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        ),
+    )
+    conn.commit()
+
+
 # --- File reading -----------------------------------------------------------
 
 def read_local_file(local_dir: str, key: str) -> str:
@@ -172,6 +620,246 @@ def read_s3_file(s3_client, key: str) -> str:
     return resp["Body"].read().decode("utf-8")
 
 
+# --- Async S3 fetcher -------------------------------------------------------
+
+S3_REGION = "us-east-1"
+
+# Responses that mean "slow down": S3 throttling and transient server errors
+S3_THROTTLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Concurrency the async fetcher starts at before AIMD adjusts it
+DEFAULT_INITIAL_CONCURRENCY = 16
+
+
+class AimdLimiter:
+    """Concurrency limit tuned additive-increase/multiplicative-decrease, like TCP.
+
+    Every `limit` successful responses raise the limit by one. A throttled
+    response (503 SlowDown, timeouts, ...) halves it, and so does latency
+    queueing up: a moving average of response times above `latency_factor`
+    times the best average seen. Only requests started after the last
+    decrease can cause another, so one burst of throttling halves the limit
+    once. Used from one event loop, so it needs no locking beyond the
+    asyncio.Condition.
+    """
+
+    # Responses averaged before latency can trigger a decrease
+    LATENCY_WARMUP = 20
+    LATENCY_EWMA_ALPHA = 0.1
+
+    def __init__(self, initial: int = DEFAULT_INITIAL_CONCURRENCY, minimum: int = 1,
+                 maximum: int = 256, latency_factor: float = 2.0):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.peak_limit = self.limit
+        self.decreases = 0
+        self._successes = 0
+        self._latency = None
+        self._latency_samples = 0
+        self._best_latency = None
+        self._epoch = 0
+        self._cond = None  # created on first use, inside the event loop
+
+    async def acquire(self) -> int:
+        """Wait for a slot; return the epoch to report the response against."""
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self._epoch
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency: float, epoch: int):
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += self.LATENCY_EWMA_ALPHA * (latency - self._latency)
+        self._latency_samples += 1
+        if self._latency_samples >= self.LATENCY_WARMUP:
+            if self._best_latency is None or self._latency < self._best_latency:
+                self._best_latency = self._latency
+            if self._latency > self.latency_factor * self._best_latency:
+                self.on_throttle(epoch)
+                return
+        self._successes += 1
+        if self._successes >= self.limit:
+            self._successes = 0
+            self.limit = min(self.maximum, self.limit + 1)
+            self.peak_limit = max(self.peak_limit, self.limit)
+
+    def on_throttle(self, epoch: int):
+        if epoch != self._epoch:
+            return  # started before the last decrease, which already covered it
+        self._epoch += 1
+        self._successes = 0
+        # Re-measure at the new limit before latency can cut it again
+        self._latency = None
+        self._latency_samples = 0
+        self.limit = max(self.minimum, self.limit // 2)
+        self.decreases += 1
+
+
+class AsyncS3Fetcher:
+    """Fetch S3 objects on an asyncio event loop with AIMD concurrency (needs aiohttp).
+
+    The loop runs in a background thread. read() blocks the calling thread
+    for one object, so it drops in as convert_week's read_fn; submit()
+    returns a concurrent.futures.Future instead. read_timed() also returns
+    how long the successful request took and, separately, how long the GET
+    queued for a concurrency slot or backed off before it. Requests share one
+    keep-alive pool of up to `max_concurrency` connections, and how many run
+    at once is set by an AimdLimiter between 1 and `max_concurrency`.
+    Throttled and failed requests are retried with jittered exponential
+    backoff.
+
+    Requests are unsigned (the bucket is public) unless `anonymous` is
+    False, in which case they're signed with SigV4 using the credentials of
+    `profile` (or the default chain). `endpoint_url` (default:
+    AWS_ENDPOINT_URL) points at an S3-compatible stand-in, addressed
+    path-style.
+    """
+
+    def __init__(
+        self,
+        profile: str | None = None,
+        anonymous: bool | None = None,
+        endpoint_url: str | None = None,
+        bucket: str = S3_BUCKET,
+        initial_concurrency: int = DEFAULT_INITIAL_CONCURRENCY,
+        max_concurrency: int = 256,
+        retries: int = 8,
+    ):
+        import aiohttp  # noqa: F401  (fail here, not on the loop thread)
+
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url or os.environ.get("AWS_ENDPOINT_URL")
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.limiter = AimdLimiter(initial_concurrency, maximum=max_concurrency)
+        self.requests = 0
+        self.throttled = 0
+        self.bytes = 0
+        self._credentials = None
+        if anonymous is False or (anonymous is None and profile):
+            import boto3
+
+            self._credentials = boto3.Session(profile_name=profile).get_credentials()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="s3-fetch", daemon=True
+        )
+        self._thread.start()
+        self._session = self._run(self._open_session())
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _open_session(self):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_concurrency,
+            limit_per_host=self.max_concurrency,
+            ttl_dns_cache=300,
+            keepalive_timeout=30,
+        )
+        timeout = aiohttp.ClientTimeout(total=60, sock_connect=10)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=False)
+
+    def _url(self, key: str) -> str:
+        from urllib.parse import quote
+
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{quote(key)}"
+        return f"https://{self.bucket}.s3.amazonaws.com/{quote(key)}"
+
+    def _headers(self, url: str) -> dict | None:
+        if self._credentials is None:
+            return None
+        from botocore.auth import S3SigV4Auth
+        from botocore.awsrequest import AWSRequest
+
+        request = AWSRequest(method="GET", url=url)
+        credentials = self._credentials.get_frozen_credentials()
+        S3SigV4Auth(credentials, "s3", S3_REGION).add_auth(request)
+        return dict(request.headers)
+
+    async def _get_timed(self, key: str) -> tuple[str, float, float]:
+        """Return the body, the successful request's seconds and the seconds queued before it."""
+        import aiohttp
+
+        url = self._url(key)
+        error = None
+        started = time.monotonic()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(random.uniform(0, min(20.0, 0.1 * 2 ** attempt)))
+            epoch = await self.limiter.acquire()
+            t0 = time.monotonic()
+            try:
+                self.requests += 1
+                async with self._session.get(url, headers=self._headers(url)) as resp:
+                    if resp.status == 200:
+                        body = await resp.read()
+                        t1 = time.monotonic()
+                        self.limiter.on_success(t1 - t0, epoch)
+                        self.bytes += len(body)
+                        return body.decode("utf-8"), t1 - t0, t0 - started
+                    if resp.status not in S3_THROTTLE_STATUSES:
+                        raise OSError(f"GET {key}: HTTP {resp.status}")
+                    error = f"HTTP {resp.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            finally:
+                await self.limiter.release()
+            self.throttled += 1
+            self.limiter.on_throttle(epoch)
+        raise OSError(f"GET {key} failed after {self.retries + 1} attempts: {error}")
+
+    async def _get(self, key: str) -> str:
+        return (await self._get_timed(key))[0]
+
+    def submit(self, key: str):
+        return asyncio.run_coroutine_threadsafe(self._get(key), self._loop)
+
+    def read(self, key: str) -> str:
+        return self.submit(key).result()
+
+    def read_timed(self, key: str) -> tuple[str, float, float]:
+        """read(), plus the request's and the queue's seconds (convert_week's timed_reads)."""
+        return asyncio.run_coroutine_threadsafe(self._get_timed(key), self._loop).result()
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "bytes": self.bytes,
+            "limit": self.limiter.limit,
+            "peak_limit": self.limiter.peak_limit,
+            "decreases": self.limiter.decreases,
+        }
+
+    def close(self):
+        self._run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 # --- Grouping ---------------------------------------------------------------
 
 def group_by_week(keys: list[str]) -> dict[str, list[str]]:
@@ -187,8 +875,1360 @@ def group_by_week(keys: list[str]) -> dict[str, list[str]]:
     return dict(sorted(groups.items()))
 
 
+# --- Compression ------------------------------------------------------------
+
+# Uncompressed bytes per independently compressed member with gzip-mt
+PARALLEL_GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+
+# zstd dictionaries live in {output_dir}/_dict/{dict_id}.zdict
+ZSTD_DICT_DIR = "_dict"
+DEFAULT_ZSTD_DICT_SIZE = 112 * 1024
+
+
+class GzipCodec:
+    """Single-threaded gzip, as zcat and every existing reader expect."""
+
+    name = "gzip"
+    suffix = ".gz"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def open(self, raw):
+        """Start a gzip member on `raw`; close() ends it and leaves `raw` open."""
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=self.level)
+
+    def install(self, output_dir: str):
+        pass
+
+
+class ParallelGzipStream:
+    """Compress fixed-size blocks as independent gzip members on a thread pool.
+
+    zlib releases the GIL, so blocks compress in parallel. Members are
+    written to `raw` in order, with at most `max_pending` blocks queued.
+    """
+
+    def __init__(self, raw, pool: ThreadPoolExecutor, level: int, block_size: int,
+                 max_pending: int):
+        self._raw = raw
+        self._pool = pool
+        self._level = level
+        self._block_size = block_size
+        self._max_pending = max_pending
+        self._buf: list[bytes] = []
+        self._buf_len = 0
+        self._pending: deque = deque()
+        self._members = 0
+
+    def write(self, data: bytes):
+        self._buf.append(data)
+        self._buf_len += len(data)
+        if self._buf_len >= self._block_size:
+            self._submit()
+
+    def _submit(self):
+        block = b"".join(self._buf)
+        self._buf = []
+        self._buf_len = 0
+        self._pending.append(
+            self._pool.submit(gzip.compress, block, self._level, mtime=0)
+        )
+        self._members += 1
+        while len(self._pending) > self._max_pending:
+            self._raw.write(self._pending.popleft().result())
+
+    def close(self):
+        # An empty stream still gets one (empty) member, like GzipFile
+        if self._buf_len or not self._members:
+            self._submit()
+        while self._pending:
+            self._raw.write(self._pending.popleft().result())
+
+
+class ParallelGzipCodec:
+    """gzip compressed on several threads, one member per 4 MiB block.
+
+    The output is an ordinary multi-member gzip file that gzip, zcat and
+    gzip.open read as one stream. Each block starts with an empty window,
+    so the ratio is slightly worse than GzipCodec at the same level.
+    """
+
+    name = "gzip-mt"
+    suffix = ".gz"
+
+    def __init__(self, level: int = 6, threads: int | None = None,
+                 block_size: int = PARALLEL_GZIP_BLOCK_SIZE):
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.block_size = block_size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def open(self, raw):
+        # One pool shared by every week being written
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.threads, thread_name_prefix="gzip"
+                )
+        return ParallelGzipStream(
+            raw, self._pool, self.level, self.block_size, self.threads * 2
+        )
+
+    def install(self, output_dir: str):
+        pass
+
+
+class ZstdCodec:
+    """zstd (needs zstandard), optionally with a trained dictionary.
+
+    With `threads` > 1, zstd compresses each stream on that many of its own
+    worker threads. A dictionary (see train_zstd_dict) is recorded by id in
+    every frame header; install() copies it into the output directory,
+    where open_compressed looks it up.
+    """
+
+    name = "zstd"
+    suffix = ".zst"
+
+    def __init__(self, level: int = 3, threads: int | None = None,
+                 dict_data: bytes | None = None):
+        import zstandard
+
+        self.level = level
+        self.threads = threads if threads and threads > 1 else 0
+        self.dict_data = None
+        if dict_data is not None:
+            self.dict_data = zstandard.ZstdCompressionDict(dict_data)
+            # Build the compression tables now, not racily on first use
+            self.dict_data.precompute_compress(level=level)
+
+    def open(self, raw):
+        """Start a zstd frame on `raw`; close() ends it and leaves `raw` open."""
+        import zstandard
+
+        # Compressors aren't thread-safe, so every stream gets its own
+        cctx = zstandard.ZstdCompressor(
+            level=self.level, dict_data=self.dict_data, threads=self.threads,
+            write_checksum=True,
+        )
+        return cctx.stream_writer(raw, closefd=False)
+
+    def install(self, output_dir: str) -> str | None:
+        """Copy the dictionary into `output_dir`; return its path (None without one)."""
+        if self.dict_data is None:
+            return None
+        path = os.path.join(output_dir, ZSTD_DICT_DIR, f"{self.dict_data.dict_id()}.zdict")
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(self.dict_data.as_bytes())
+        os.rename(path + ".tmp", path)
+        return path
+
+
+COMPRESSIONS = {"gzip": GzipCodec, "gzip-mt": ParallelGzipCodec, "zstd": ZstdCodec}
+
+
+def make_codec(
+    name: str = "gzip",
+    level: int | None = None,
+    threads: int | None = None,
+    zstd_dict: str | None = None,
+):
+    """Build the codec for a --compression choice."""
+    kwargs = {} if level is None else {"level": level}
+    if name == "gzip":
+        return GzipCodec(**kwargs)
+    if name == "gzip-mt":
+        return ParallelGzipCodec(threads=threads, **kwargs)
+    dict_data = None
+    if zstd_dict is not None:
+        with open(zstd_dict, "rb") as f:
+            dict_data = f.read()
+    return ZstdCodec(threads=threads, dict_data=dict_data, **kwargs)
+
+
+def load_zstd_dict(path: str, dict_id: int):
+    """Find dictionary `dict_id` for a .zst output in its directory or the one above."""
+    import zstandard
+
+    directory = os.path.dirname(os.path.abspath(path))
+    # Partition files sit one level below --output-dir
+    for base in (directory, os.path.dirname(directory)):
+        dict_path = os.path.join(base, ZSTD_DICT_DIR, f"{dict_id}.zdict")
+        if os.path.exists(dict_path):
+            with open(dict_path, "rb") as f:
+                return zstandard.ZstdCompressionDict(f.read())
+    raise FileNotFoundError(f"{path}: zstd dictionary {dict_id} not found in {ZSTD_DICT_DIR}/")
+
+
+def open_compressed(path: str, offset: int = 0, length: int | None = None):
+    """Open a .gz or .zst output for reading decompressed bytes.
+
+    With `offset`/`length`, only that byte range is read; it must start and
+    end on gzip member or zstd frame boundaries, as blocks in a block index do.
+    """
+    if offset or length is not None:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            raw = io.BytesIO(f.read(-1 if length is None else length))
+    elif path.endswith(".zst"):
+        raw = open(path, "rb")
+    else:
+        return gzip.open(path, "rb")
+    if not path.endswith(".zst"):
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    import zstandard
+
+    header = raw.read(18)  # longest possible zstd frame header
+    raw.seek(0)
+    dict_id = zstandard.get_frame_parameters(header).dict_id if header else 0
+    dctx = zstandard.ZstdDecompressor(
+        dict_data=load_zstd_dict(path, dict_id) if dict_id else None
+    )
+    reader = dctx.stream_reader(raw, read_across_frames=True, closefd=True)
+    return io.BufferedReader(reader)
+
+
+def open_jsonl(path: str, offset: int = 0, length: int | None = None):
+    """Open a .jsonl.gz or .jsonl.zst output (or a byte range of one) for reading lines."""
+    return io.TextIOWrapper(open_compressed(path, offset, length), encoding="utf-8")
+
+
+def train_zstd_dict(
+    paths: list[str],
+    dict_size: int = DEFAULT_ZSTD_DICT_SIZE,
+    every: int = 50,
+    max_per_file: int = 20000,
+) -> bytes:
+    """Train a zstd dictionary on every `every`th record of some JSONL outputs."""
+    import zstandard
+
+    samples = []
+    for path in paths:
+        with open_compressed(path) as f:
+            lines = itertools.islice(f, 0, every * max_per_file, every)
+            samples.extend(lines)
+    return zstandard.train_dictionary(dict_size, samples).as_bytes()
+
+
+# --- Output formats ---------------------------------------------------------
+
+# Arrow type for each column of --format parquet. Record fields not listed
+# here are kept as a JSON object in the "extra" column.
+PARQUET_COLUMNS = {
+    "time": "int64",
+    "snapshot_time": "timestamp",
+    "vehicleID": "int32",
+    "routeNumber": "int32",
+    "direction": "int32",
+    "tripID": "string",
+    "blockID": "int32",
+    "extraBlockID": "int32",
+    "lastLocID": "int32",
+    "nextLocID": "int32",
+    "lastStopSeq": "int32",
+    "nextStopSeq": "int32",
+    "latitude": "float64",
+    "longitude": "float64",
+    "bearing": "int32",
+    "delay": "int32",
+    "loadPercentage": "int32",
+    "locationInScheduleDay": "int32",
+    "messageCode": "int32",
+    "serviceDate": "int64",
+    "expires": "int64",
+    "newTrip": "bool",
+    "offRoute": "bool",
+    "inCongestion": "bool",
+    "type": "dictionary",
+    "source": "dictionary",
+    "garage": "dictionary",
+    "signMessage": "dictionary",
+    "signMessageLong": "dictionary",
+    "extra": "string",
+}
+
+# Rows buffered, sorted by time and written per Parquet row group
+PARQUET_ROW_GROUP_SIZE = 256 * 1024
+
+# Small batches (e.g. one route's records from one snapshot) buffered by a
+# Parquet writer before they are concatenated into one
+PARQUET_COMBINE_BATCHES = 16
+
+# Rows buffered across all of a partitioned week's Parquet files; past it
+# the partitions holding the most are written out as row groups
+PARTITIONED_BUFFER_ROWS = PARQUET_ROW_GROUP_SIZE
+
+
+def parquet_schema():
+    """Return the fixed Arrow schema for --format parquet."""
+    import pyarrow as pa
+
+    types = {
+        "int32": pa.int32(),
+        "int64": pa.int64(),
+        "float64": pa.float64(),
+        "bool": pa.bool_(),
+        "string": pa.string(),
+        "dictionary": pa.dictionary(pa.int32(), pa.string()),
+        "timestamp": pa.timestamp("ms", tz="UTC"),
+    }
+    return pa.schema([(name, types[t]) for name, t in PARQUET_COLUMNS.items()])
+
+
+def records_to_batch(records: list[dict], snapshot_dt: datetime.datetime):
+    """Build an Arrow RecordBatch of one snapshot file's records."""
+    import pyarrow as pa
+
+    fields = [name for name in PARQUET_COLUMNS if name not in ("snapshot_time", "extra")]
+    columns: dict[str, list] = {name: [] for name in fields}
+    columns["extra"] = []
+    for record in records:
+        for name in fields:
+            columns[name].append(record.get(name))
+        extra = {k: v for k, v in record.items() if k not in columns}
+        columns["extra"].append(json.dumps(extra, separators=(",", ":")) if extra else None)
+    columns["snapshot_time"] = [snapshot_dt] * len(records)
+    return pa.RecordBatch.from_pydict(columns, schema=parquet_schema())
+
+
+class Crc32Writer:
+    """File wrapper that keeps a running CRC32 of the bytes written through it."""
+
+    def __init__(self, f, crc: int = 0):
+        self._f = f
+        self.crc = crc
+
+    def write(self, data) -> int:
+        self.crc = zlib.crc32(data, self.crc)
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+class JsonlWeekWriter:
+    """Write JSONL byte chunks to a compressed file (gzip unless `codec` says otherwise).
+
+    Writes go to `path` + ".tmp"; commit() renames it into place.
+
+    end_block() ends the current gzip member (or zstd frame), so the bytes
+    written since the previous block decompress on their own. With
+    `index_blocks`, each block's byte range and snapshot_time range is
+    recorded in `blocks`, and commit() saves it as the block index (see
+    read_time_range).
+
+    Validation happens while writing: `checksums` counts lines, keeps a
+    CRC32 of the uncompressed lines and of the compressed bytes, and
+    schema-checks every VALIDATE_SAMPLE_EVERY-th line. commit() saves it as
+    the output's manifest (see verify_output).
+
+    checkpoint() ends the current member (index it with end_block() first)
+    and returns the byte offset where the next one starts. Passing a saved
+    checkpoint back as `resume` truncates the .tmp file at its offset,
+    restores its blocks and checksums, and appends a new member, which
+    readers decompress as one continuous stream.
+
+    With `dedup`, each chunk written must be one snapshot, and lines that
+    repeat a line of the previous snapshot (see SnapshotDeduper) are left
+    out of the file and recorded in the `{output}.repeats` sidecar instead.
+    Blocks and checkpoints start dedup afresh, so each block expands on
+    its own.
+
+    With `upload` (an S3Destination), the compressed bytes stream into an
+    S3 multipart upload instead of the .tmp file, and commit() completes it
+    after uploading the sidecars, so the object appears only once the week
+    is whole; abort() discards it. Uploads can't be checkpointed.
+    """
+
+    extension = ".jsonl"  # plus the codec's suffix
+    uses_codec = True
+    supports_checkpoints = True
+    supports_blocks = True
+    supports_dedup = True
+    supports_upload = True
+
+    def __init__(
+        self,
+        path: str,
+        codec=None,
+        index_blocks: bool = False,
+        resume: dict | None = None,
+        dedup: bool = False,
+        upload: S3Destination | None = None,
+    ):
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.codec = codec if codec is not None else GzipCodec()
+        self.upload = upload
+        if upload is not None:
+            if resume is not None:
+                raise ValueError("an upload can't resume from a checkpoint")
+            self.blocks = [] if index_blocks else None
+            self.checksums = new_checksums()
+            f = upload.open(path)
+        elif resume is None:
+            self.blocks = [] if index_blocks else None
+            self.checksums = new_checksums()
+            f = open(self.temp_path, "wb")
+        else:
+            self.blocks = resume.get("blocks")
+            self.checksums = dict(resume["checksums"])
+            dedup = resume.get("repeats_offset") is not None
+            f = open(self.temp_path, "r+b")
+            f.truncate(resume["offset"])
+            f.seek(resume["offset"])
+        self._raw = Crc32Writer(f, self.checksums["compressed_crc32"])
+        self.deduper = None
+        if dedup:
+            self.checksums.setdefault("repeated_records", 0)
+            self.deduper = SnapshotDeduper(
+                repeats_path_for(path) + ".tmp",
+                resume["repeats_offset"] if resume is not None else None,
+            )
+        # Opened on first write, so a block boundary never leaves an empty member
+        self._stream = None
+        self._block_start = 0
+        self._block_repeats_start = 0
+
+    @property
+    def repeated_records(self) -> int:
+        return self.checksums.get("repeated_records", 0)
+
+    def write(self, chunk: bytes):
+        if self._stream is None:
+            self._block_start = self._raw.tell()
+            if self.deduper is not None:
+                self._block_repeats_start = self.deduper.tell()
+            self._stream = self.codec.open(self._raw)
+        if self.deduper is not None:
+            chunk, repeats = self.deduper.drop_repeats(chunk)
+            self.checksums["repeated_records"] += repeats
+        self._stream.write(chunk)
+        update_checksums(self.checksums, chunk, self.path)
+
+    def end_block(self, first: str | None = None, last: str | None = None, records: int = 0):
+        """End the current member; index it as snapshots `first`..`last`."""
+        if self.deduper is not None:
+            self.deduper.reset()
+        if self._stream is None:
+            return
+        self._stream.close()  # writes the member trailer; leaves _raw open
+        self._stream = None
+        if self.blocks is not None and records:
+            block = {
+                "offset": self._block_start,
+                "length": self._raw.tell() - self._block_start,
+                "first": first,
+                "last": last,
+                "records": records,
+            }
+            if self.deduper is not None:
+                block["repeats_offset"] = self._block_repeats_start
+            self.blocks.append(block)
+
+    @property
+    def repeats_offset(self) -> int | None:
+        """Sidecar offset to resume from, as of the last checkpoint() (None without dedup)."""
+        return self.deduper.tell() if self.deduper is not None else None
+
+    def checkpoint(self) -> int:
+        self.end_block()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        if self.deduper is not None:
+            self.deduper.sync()
+        self.checksums["compressed_crc32"] = self._raw.crc
+        return self._raw.tell()
+
+    def close(self):
+        if self._stream is None and self._raw.tell() == 0:
+            # An empty week is still a valid (empty) compressed file
+            self._stream = self.codec.open(self._raw)
+        if self._stream is not None:
+            self._stream.close()
+        self.checksums["compressed_crc32"] = self._raw.crc
+        self.checksums["compressed_bytes"] = self._raw.tell()
+        self._raw.close()
+        if self.deduper is not None:
+            self.deduper.close()
+
+    def commit(self):
+        if self.blocks:
+            save_block_index(self.path, self.blocks)
+        if self.deduper is not None:
+            os.rename(self.deduper.path, repeats_path_for(self.path))
+        save_output_manifest(self.path, self.checksums)
+        if self.upload is None:
+            os.rename(self.temp_path, self.path)
+            return
+        try:
+            for path in (block_index_path_for(self.path), repeats_path_for(self.path)):
+                if os.path.exists(path):
+                    self.upload.upload_file(path)
+            self.upload.upload_file(output_manifest_path_for(self.path))
+            self._raw.complete()
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        """Discard an upload that won't be committed (local .tmp files are kept to resume)."""
+        if self.upload is not None:
+            self._raw.abort()
+
+    def validate(self, expected_records: int) -> int:
+        return validate_checksums(self.path, self.checksums, expected_records)
+
+
+class ParquetWeekWriter:
+    """Write RecordBatches to a Parquet file in row groups sorted by time.
+
+    Writes go to `path` + ".tmp"; commit() renames it into place.
+    """
+
+    extension = ".parquet"
+    uses_codec = False  # compressed internally with zstd
+    supports_checkpoints = False
+    supports_blocks = False  # row group statistics already cover time ranges
+    supports_dedup = False
+    supports_upload = False
+
+    def __init__(self, path: str, row_group_size: int = PARQUET_ROW_GROUP_SIZE):
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self._schema = parquet_schema()
+        self._writer = pq.ParquetWriter(
+            self.temp_path,
+            self._schema,
+            compression="zstd",
+            sorting_columns=[pq.SortingColumn(self._schema.get_field_index("time"))],
+        )
+        self._row_group_size = row_group_size
+        self._batches = []
+        self._rows = 0
+
+    @property
+    def buffered_rows(self) -> int:
+        return self._rows
+
+    def write(self, batch):
+        self._batches.append(batch)
+        self._rows += batch.num_rows
+        if self._rows >= self._row_group_size:
+            self.flush()
+        elif len(self._batches) >= PARQUET_COMBINE_BATCHES:
+            self._combine()
+
+    def _combine(self):
+        """Concatenate the buffered batches, whose many small buffers cost far more than their rows."""
+        import pyarrow as pa
+
+        table = pa.Table.from_batches(self._batches, self._schema).combine_chunks()
+        self._batches = table.to_batches()
+
+    def flush(self):
+        """Write the buffered rows as one row group, sorted by time."""
+        import pyarrow as pa
+
+        if not self._rows:
+            return
+        table = pa.Table.from_batches(self._batches, self._schema).sort_by("time")
+        self._writer.write_table(table, row_group_size=table.num_rows)
+        self._batches = []
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def commit(self):
+        os.rename(self.temp_path, self.path)
+
+    def validate(self, expected_records: int) -> int:
+        return validate_parquet(self.path, expected_records)
+
+
+OUTPUT_FORMATS = {"jsonl": JsonlWeekWriter, "parquet": ParquetWeekWriter}
+
+
+def output_extension(fmt: str, codec=None) -> str:
+    """Return a format's file extension, e.g. ".jsonl.gz", ".jsonl.zst" or ".parquet"."""
+    writer_cls = OUTPUT_FORMATS[fmt]
+    if not writer_cls.uses_codec:
+        return writer_cls.extension
+    return writer_cls.extension + (codec if codec is not None else GzipCodec).suffix
+
+
+def open_format_writer(
+    path: str,
+    fmt: str,
+    codec=None,
+    index_blocks: bool = False,
+    resume: dict | None = None,
+    dedup: bool = False,
+    upload: S3Destination | None = None,
+):
+    """Open the writer for one output file in the given format."""
+    writer_cls = OUTPUT_FORMATS[fmt]
+    kwargs = {}
+    if upload is not None:
+        if not writer_cls.supports_upload:
+            raise ValueError(f"{fmt} output can't be uploaded while writing")
+        kwargs["upload"] = upload
+    if writer_cls.uses_codec:
+        kwargs["codec"] = codec
+    if index_blocks and writer_cls.supports_blocks:
+        kwargs["index_blocks"] = True
+    if resume is not None:
+        kwargs["resume"] = resume
+    if dedup and writer_cls.supports_dedup:
+        kwargs["dedup"] = True
+    return writer_cls(path, **kwargs)
+
+
+# --partition-by choice -> record field the output is partitioned on
+PARTITION_FIELDS = {"route": "routeNumber"}
+
+# Hive's directory name for a null partition value, so Athena reads it as NULL
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def partition_value(value) -> str:
+    """Return the directory-safe partition value for a record field."""
+    return NULL_PARTITION if value is None else str(value)
+
+
+class PartitionedWeekWriter:
+    """Write one file per partition value, e.g. route=19/week=2021-W45.jsonl.gz.
+
+    Each partition gets its own format writer, opened on first use. commit()
+    renames every partition file into place and then writes the week's
+    marker file (see output_path_for), which lists the partitions and their
+    record counts and is what resume checks for.
+
+    With `index_blocks`, end_block() ends a block in every partition file
+    that was written to since the last one, and each file gets its own
+    block index. With `dedup`, each partition file is deduplicated against
+    its own previous snapshot.
+
+    Parquet partitions buffer rows until a row group fills, which a single
+    route rarely does in a week. So each concatenates its small batches as
+    they pile up, and the rows buffered across all partitions are capped
+    at `max_buffered_rows`: past it, the partitions holding the most are
+    flushed as row groups until half of it is left.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        week: str,
+        fmt: str,
+        partition_by: str,
+        codec=None,
+        index_blocks: bool = False,
+        dedup: bool = False,
+        max_buffered_rows: int = PARTITIONED_BUFFER_ROWS,
+    ):
+        self.output_dir = output_dir
+        self.week = week
+        self.fmt = fmt
+        self.partition_by = partition_by
+        self.codec = codec
+        self.index_blocks = index_blocks
+        self.dedup = dedup
+        self.supports_blocks = OUTPUT_FORMATS[fmt].supports_blocks
+        self.path = output_path_for(output_dir, week, fmt, partition_by, codec)
+        self.counts: dict[str, int] = {}
+        self._block_counts: dict[str, int] = defaultdict(int)
+        self._writers: dict[str, object] = {}
+        self.max_buffered_rows = max_buffered_rows
+
+    def _partition_path(self, value: str) -> str:
+        return os.path.join(
+            self.output_dir,
+            f"{self.partition_by}={value}",
+            f"week={self.week}{output_extension(self.fmt, self.codec)}",
+        )
+
+    def write(self, chunks: dict):
+        for value, (chunk, count) in chunks.items():
+            writer = self._writers.get(value)
+            if writer is None:
+                path = self._partition_path(value)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writer = self._writers[value] = open_format_writer(
+                    path, self.fmt, self.codec, index_blocks=self.index_blocks,
+                    dedup=self.dedup,
+                )
+                self.counts[value] = 0
+            writer.write(chunk)
+            self.counts[value] += count
+            self._block_counts[value] += count
+        if hasattr(next(iter(self._writers.values()), None), "buffered_rows"):
+            buffered = sum(writer.buffered_rows for writer in self._writers.values())
+            if buffered > self.max_buffered_rows:
+                self._flush_largest(buffered)
+
+    def _flush_largest(self, buffered: int):
+        """Flush the partitions buffering the most rows until half the cap is left."""
+        for writer in sorted(self._writers.values(), key=lambda w: w.buffered_rows, reverse=True):
+            if buffered <= self.max_buffered_rows // 2:
+                break
+            buffered -= writer.buffered_rows
+            writer.flush()
+
+    def end_block(self, first: str | None = None, last: str | None = None, records: int = 0):
+        for value, count in self._block_counts.items():
+            self._writers[value].end_block(first, last, count)
+        self._block_counts.clear()
+
+    @property
+    def repeated_records(self) -> int:
+        return sum(getattr(writer, "repeated_records", 0) for writer in self._writers.values())
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+
+    def commit(self):
+        for writer in self._writers.values():
+            writer.commit()
+        marker = {
+            "week": self.week,
+            "format": self.fmt,
+            "partition_by": self.partition_by,
+            "partitions": {
+                value: {
+                    "path": os.path.relpath(writer.path, self.output_dir),
+                    "records": self.counts[value],
+                }
+                for value, writer in sorted(self._writers.items())
+            },
+        }
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(marker, f, indent=2)
+        os.rename(self.path + ".tmp", self.path)
+
+    def validate(self, expected_records: int) -> int:
+        errors = sum(
+            writer.validate(self.counts[value])
+            for value, writer in self._writers.items()
+        )
+        if sum(self.counts.values()) != expected_records:
+            print(
+                f"  VALIDATE MISMATCH: wrote {expected_records} records but "
+                f"partitions hold {sum(self.counts.values())}",
+                file=sys.stderr,
+            )
+            errors += 1
+        return errors
+
+
+def output_path_for(
+    output_dir: str,
+    week: str,
+    fmt: str = "jsonl",
+    partition_by: str | None = None,
+    codec=None,
+) -> str:
+    """Return the path whose existence marks a week as converted.
+
+    That is the week's single output file, or for a partitioned layout the
+    marker file `_weeks/{week}.json` listing its partition files.
+    """
+    if partition_by is not None:
+        return os.path.join(output_dir, "_weeks", f"{week}.json")
+    return os.path.join(output_dir, week + output_extension(fmt, codec))
+
+
+def open_week_writer(
+    output_dir: str,
+    week: str,
+    fmt: str = "jsonl",
+    partition_by: str | None = None,
+    codec=None,
+    index_blocks: bool = False,
+    resume: dict | None = None,
+    dedup: bool = False,
+    upload: S3Destination | None = None,
+):
+    """Open the writer for a week's output in the given format and layout.
+
+    `resume` is a checkpoint saved by convert_week to continue from.
+    `upload` streams the output to S3 (single-file layout only).
+    """
+    if partition_by is not None:
+        if upload is not None:
+            raise ValueError("partitioned output can't be uploaded while writing")
+        return PartitionedWeekWriter(
+            output_dir, week, fmt, partition_by, codec, index_blocks, dedup,
+        )
+    path = output_path_for(output_dir, week, fmt, codec=codec)
+    return open_format_writer(path, fmt, codec, index_blocks, resume, dedup, upload)
+
+
+# --- Checkpoints --------------------------------------------------------------
+
+# Files written between checkpoints of a week's .tmp output
+DEFAULT_CHECKPOINT_EVERY = 500
+
+
+def supports_checkpoints(fmt: str, partition_by: str | None) -> bool:
+    """Return True if a week in this format and layout can be checkpointed."""
+    return partition_by is None and OUTPUT_FORMATS[fmt].supports_checkpoints
+
+
+def checkpoint_path_for(output_path: str) -> str:
+    return output_path + ".ckpt"
+
+
+def save_checkpoint(output_path: str, checkpoint: dict):
+    """Atomically write a week's checkpoint next to its output."""
+    path = checkpoint_path_for(output_path)
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path + ".tmp", path)
+
+
+def load_checkpoint(output_path: str) -> dict | None:
+    """Return a week's checkpoint if its .tmp output still reaches the offset."""
+    path = checkpoint_path_for(output_path)
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+        # Checkpoints from before inline validation have no checksums; restart those
+        if "checksums" in checkpoint and os.path.getsize(output_path + ".tmp") >= checkpoint["offset"]:
+            return checkpoint
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def clear_checkpoint(output_path: str):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(checkpoint_path_for(output_path))
+
+
+# --- Block index --------------------------------------------------------------
+
+# Snapshot files per independently decompressible block (about an hour)
+DEFAULT_BLOCK_FILES = 60
+
+
+def block_index_path_for(output_path: str) -> str:
+    return output_path + ".idx"
+
+
+def save_block_index(output_path: str, blocks: list[dict]):
+    """Atomically write an output's block index next to it."""
+    path = block_index_path_for(output_path)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"blocks": blocks}, f)
+    os.rename(path + ".tmp", path)
+
+
+def load_block_index(output_path: str) -> list[dict] | None:
+    """Return an output's blocks, or None if it was written without an index."""
+    try:
+        with open(block_index_path_for(output_path)) as f:
+            return json.load(f)["blocks"]
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_time_str(dt: datetime.datetime) -> str:
+    """Format a datetime the way records' snapshot_time is (naive = UTC)."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.astimezone(datetime.timezone.utc).isoformat()
+
+
+# How snapshot_time starts in a written line; it is the line's last key
+SNAPSHOT_TIME_KEY = b'"snapshot_time":"'
+
+
+def line_snapshot_time(line: bytes) -> bytes:
+    """Return a written JSONL line's snapshot_time without decoding the line."""
+    start = line.rindex(SNAPSHOT_TIME_KEY) + len(SNAPSHOT_TIME_KEY)
+    return line[start:line.index(b'"', start)]
+
+
+def read_time_range_lines(
+    output_path: str,
+    start: datetime.datetime | None = None,
+    end: datetime.datetime | None = None,
+    expand: bool = True,
+):
+    """Yield the lines (bytes) of a JSONL output with start <= snapshot_time < end.
+
+    Either bound may be None for an open-ended window. With a block index,
+    decompression starts at the first block overlapping the window and
+    stops after the last one; without one, the file is read from the start.
+    Either way reading stops at the first later snapshot.
+
+    A deduplicated output (see SnapshotDeduper) is read with its repeats put
+    back, unless `expand` is False.
+    """
+    start_str = snapshot_time_str(start) if start is not None else None
+    end_str = snapshot_time_str(end) if end is not None else None
+    offset, length, repeats_offset = 0, None, 0
+    blocks = load_block_index(output_path)
+    if blocks is not None and (start_str or end_str):
+        hits = [
+            b for b in blocks
+            if (start_str is None or b["last"] >= start_str)
+            and (end_str is None or b["first"] < end_str)
+        ]
+        if not hits:
+            return
+        offset = hits[0]["offset"]
+        length = hits[-1]["offset"] + hits[-1]["length"] - offset
+        repeats_offset = hits[0].get("repeats_offset", 0)
+    start_bytes = start_str.encode() if start_str is not None else None
+    end_bytes = end_str.encode() if end_str is not None else None
+    with contextlib.ExitStack() as stack:
+        if expand and os.path.exists(repeats_path_for(output_path)):
+            lines = iter_expanded_lines(output_path, offset, length, repeats_offset)
+        else:
+            lines = stack.enter_context(open_compressed(output_path, offset, length))
+        if start_bytes is None and end_bytes is None:
+            yield from lines
+            return
+        for line in lines:
+            snapshot_time = line_snapshot_time(line)
+            if end_bytes is not None and snapshot_time >= end_bytes:
+                return
+            if start_bytes is None or snapshot_time >= start_bytes:
+                yield line
+
+
+def read_time_range(
+    output_path: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    expand: bool = True,
+):
+    """Yield the records of a JSONL output with start <= snapshot_time < end.
+
+    See read_time_range_lines, which this decodes.
+    """
+    for line in read_time_range_lines(output_path, start, end, expand):
+        yield json.loads(line)
+
+
+# --- Snapshot dedup -----------------------------------------------------------
+
+def repeats_path_for(output_path: str) -> str:
+    return output_path + ".repeats"
+
+
+def snapshot_time_token(snapshot_time: str) -> bytes:
+    """Return the snapshot_time key and value as they appear in a written line."""
+    return b'"snapshot_time":' + JSONL_ENCODER.encode(snapshot_time).encode("utf-8")
+
+
+class SnapshotDeduper:
+    """Drop JSONL lines that repeat the previous snapshot, recording them in a sidecar.
+
+    The feed is a full fleet snapshot every minute, and a vehicle on layover
+    or with stale GPS reports the same record minute after minute. A line
+    is a repeat when it equals a line of the previous snapshot with only
+    its snapshot_time changed; vehicleID is part of the line, so that is
+    the same vehicle's report with nothing in it updated.
+
+    The sidecar at `path` gets one JSON line per snapshot: its
+    snapshot_time, how many of its lines were kept, and its repeats as runs
+    [position in this snapshot, position of the line it repeats in the
+    previous snapshot, run length]. iter_expanded_lines puts them back.
+    """
+
+    def __init__(self, path: str, resume_offset: int | None = None):
+        self.path = path
+        if resume_offset is None:
+            self._f = open(path, "wb")
+        else:
+            self._f = open(path, "r+b")
+            self._f.truncate(resume_offset)
+            self._f.seek(resume_offset)
+        self.reset()
+
+    def reset(self):
+        """Forget the previous snapshot, so the next one is kept whole."""
+        self._previous: dict[bytes, int] = {}
+        self._previous_lines: list[bytes] = []
+        self._previous_token = b""
+
+    def drop_repeats(self, chunk: bytes) -> tuple[bytes, int]:
+        """Return one snapshot's chunk without its repeats, and how many were dropped."""
+        if not chunk:
+            return chunk, 0
+        lines = chunk.split(b"\n")
+        lines.pop()  # empty, after the last newline
+        snapshot_time = json.loads(lines[0])["snapshot_time"]
+        token = snapshot_time_token(snapshot_time)
+        previous, previous_lines = self._previous, self._previous_lines
+        previous_token = self._previous_token
+        current: dict[bytes, int] = {}
+        kept = []
+        repeats = []  # runs of [pos, previous_pos, count]
+        for pos, line in enumerate(lines):
+            key = line.replace(token, b"")
+            previous_pos = previous.get(key)
+            # Keys match if the lines differ only in snapshot_time; rebuilding
+            # the line the way the expander will makes the round trip exact
+            if (
+                previous_pos is not None
+                and previous_lines[previous_pos].replace(previous_token, token) == line
+            ):
+                run = repeats[-1] if repeats else None
+                if run and run[0] + run[2] == pos and run[1] + run[2] == previous_pos:
+                    run[2] += 1
+                else:
+                    repeats.append([pos, previous_pos, 1])
+            else:
+                kept.append(line)
+            current.setdefault(key, pos)
+        self._previous, self._previous_lines, self._previous_token = current, lines, token
+        entry = {"snapshot_time": snapshot_time, "kept": len(kept), "repeats": repeats}
+        self._f.write(JSONL_ENCODER.encode(entry).encode("utf-8") + b"\n")
+        if not repeats:
+            return chunk, 0
+        kept.append(b"")
+        return b"\n".join(kept), len(lines) - len(kept) + 1
+
+    def tell(self) -> int:
+        return self._f.tell()
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
+
+
+def iter_expanded_lines(
+    output_path: str,
+    offset: int = 0,
+    length: int | None = None,
+    repeats_offset: int = 0,
+):
+    """Yield a deduplicated JSONL output's lines (bytes) with its repeats put back.
+
+    The result is byte for byte what the output would hold without dedup.
+    For a ranged read, `offset`/`length` and `repeats_offset` must be where
+    blocks start in the output and its sidecar, as in the block index.
+    """
+    previous_lines: list[bytes] = []
+    previous_token = b""
+    with open(repeats_path_for(output_path), "rb") as sidecar:
+        sidecar.seek(repeats_offset)
+        with open_compressed(output_path, offset, length) as f:
+            for entry_line in sidecar:
+                entry = json.loads(entry_line)
+                kept = [f.readline() for _ in range(entry["kept"])]
+                if kept and not kept[0]:
+                    return  # past the end of a ranged read
+                if kept and not kept[-1]:
+                    raise ValueError(f"{output_path} ends inside snapshot {entry['snapshot_time']}")
+                token = snapshot_time_token(entry["snapshot_time"])
+                lines: list = [None] * (len(kept) + sum(run[2] for run in entry["repeats"]))
+                for pos, previous_pos, count in entry["repeats"]:
+                    for i in range(count):
+                        lines[pos + i] = previous_lines[previous_pos + i].replace(previous_token, token)
+                kept_lines = iter(kept)
+                lines = [line if line is not None else next(kept_lines) for line in lines]
+                yield from lines
+                previous_lines, previous_token = lines, token
+
+
+# --- Validation ---------------------------------------------------------------
+
+# Every Nth line written is parsed and schema-checked
+VALIDATE_SAMPLE_EVERY = 1000
+
+# JSON types accepted for each PARQUET_COLUMNS type; null is always allowed
+SCHEMA_JSON_TYPES = {
+    "int32": int,
+    "int64": int,
+    "float64": (int, float),
+    "bool": bool,
+    "string": str,
+    "dictionary": str,
+    "timestamp": str,
+}
+
+
+def check_record_schema(record) -> str | None:
+    """Return what's wrong with a written record's fields, or None if nothing."""
+    if not isinstance(record, dict):
+        return "not a JSON object"
+    if "snapshot_time" not in record:
+        return "missing snapshot_time"
+    for name, type_name in PARQUET_COLUMNS.items():
+        value = record.get(name)
+        if value is None or name == "extra":
+            continue
+        expected = SCHEMA_JSON_TYPES[type_name]
+        # bool is an int subclass, so it must not pass as a number
+        if not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            return f"{name} is {type(value).__name__}, expected {type_name}"
+    return None
+
+
+def new_checksums() -> dict:
+    return {
+        "records": 0,
+        "content_crc32": 0,
+        "compressed_bytes": 0,
+        "compressed_crc32": 0,
+        "sampled_records": 0,
+        "schema_errors": 0,
+    }
+
+
+def update_checksums(checksums: dict, chunk: bytes, output_path: str):
+    """Fold a written JSONL chunk into running checksums, schema-checking sampled lines."""
+    first = checksums["records"]
+    checksums["records"] += chunk.count(b"\n")
+    checksums["content_crc32"] = zlib.crc32(chunk, checksums["content_crc32"])
+    # Index (within this chunk) of the first line number that's a multiple of N
+    sample = -first % VALIDATE_SAMPLE_EVERY
+    if first + sample >= checksums["records"]:
+        return
+    lines = chunk.split(b"\n")
+    for i in range(sample, checksums["records"] - first, VALIDATE_SAMPLE_EVERY):
+        checksums["sampled_records"] += 1
+        try:
+            error = check_record_schema(json.loads(lines[i]))
+        except ValueError as e:
+            error = str(e)
+        if error is not None:
+            checksums["schema_errors"] += 1
+            print(f"  SCHEMA ERROR {output_path} line {first + i + 1}: {error}", file=sys.stderr)
+
+
+def output_manifest_path_for(output_path: str) -> str:
+    return output_path + ".manifest.json"
+
+
+def save_output_manifest(output_path: str, checksums: dict):
+    """Atomically write an output's checksum manifest next to it."""
+    path = output_manifest_path_for(output_path)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"output": os.path.basename(output_path), **checksums}, f, indent=2)
+    os.rename(path + ".tmp", path)
+
+
+def validate_checksums(output_path: str, checksums: dict, expected_records: int) -> int:
+    """Check the checksums gathered while writing an output; return the error count."""
+    errors = checksums["schema_errors"]
+    repeated = checksums.get("repeated_records", 0)
+    if checksums["records"] + repeated != expected_records:
+        print(
+            f"  VALIDATE MISMATCH: {output_path}: converted {expected_records} "
+            f"records but wrote {checksums['records']} lines"
+            + (f" and {repeated} repeats" if repeated else ""),
+            file=sys.stderr,
+        )
+        errors += 1
+    return errors
+
+
+def verify_output(output_path: str, deep: bool = False) -> list[str]:
+    """Check an output against its manifest; return the problems found.
+
+    Compares the size and CRC32 of the compressed file, so nothing is
+    decompressed. With `deep`, also decompresses it and compares the line
+    count and CRC32 of the content.
+    """
+    with open(output_manifest_path_for(output_path)) as f:
+        manifest = json.load(f)
+    size = os.path.getsize(output_path)
+    if size != manifest["compressed_bytes"]:
+        return [f"{size} bytes, manifest says {manifest['compressed_bytes']}"]
+    problems = []
+    crc = 0
+    with open(output_path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            crc = zlib.crc32(block, crc)
+    if crc != manifest["compressed_crc32"]:
+        problems.append("compressed CRC32 differs from manifest")
+    if deep:
+        lines = crc = 0
+        with open_compressed(output_path) as f:
+            while block := f.read(1024 * 1024):
+                lines += block.count(b"\n")
+                crc = zlib.crc32(block, crc)
+        if lines != manifest["records"]:
+            problems.append(f"{lines} lines, manifest says {manifest['records']}")
+        if crc != manifest["content_crc32"]:
+            problems.append("content CRC32 differs from manifest")
+    return problems
+
+
+def validate_parquet(output_path: str, expected_records: int) -> int:
+    """Re-read a Parquet output and verify row count and schema; return the error count."""
+    import pyarrow.parquet as pq
+
+    errors = 0
+    pf = pq.ParquetFile(output_path)
+    if not pf.schema_arrow.equals(parquet_schema()):
+        print(f"  VALIDATE ERROR {output_path}: unexpected schema", file=sys.stderr)
+        errors += 1
+    snapshot_times = pf.read(columns=["snapshot_time"]).column("snapshot_time")
+    if snapshot_times.null_count:
+        print(
+            f"  VALIDATE ERROR {output_path}: {snapshot_times.null_count} rows missing snapshot_time",
+            file=sys.stderr,
+        )
+        errors += 1
+    count = pf.metadata.num_rows
+    if count != expected_records:
+        print(
+            f"  VALIDATE MISMATCH: wrote {expected_records} but read back {count}",
+            file=sys.stderr,
+        )
+        errors += 1
+    return errors
+
+
 # --- Conversion -------------------------------------------------------------
 
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Return the peak resident set size in MB for this process (or children).
+
+    This is the peak over the process's whole life so far (ru_maxrss), not
+    over any one week.
+    """
+    rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in KiB on Linux but in bytes on macOS
+    if sys.platform == "darwin":
+        return rss / (1024 * 1024)
+    return rss / 1024
+
+
+def parse_size(text: str) -> int:
+    """Parse a byte count like '268435456', '256M' or '1G'."""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper().removesuffix("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+class InflightBudget:
+    """Downloaded-but-unwritten bytes, shared by every week in flight."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.bytes = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def add(self, n: int):
+        with self._lock:
+            self.bytes += n
+            self.peak = max(self.peak, self.bytes)
+
+    def release(self, n: int):
+        with self._lock:
+            self.bytes -= n
+
+    def exhausted(self) -> bool:
+        return self.bytes >= self.limit
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Return the nearest-rank q-th percentile of sorted values (0 if empty)."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+class StageMetrics:
+    """Per-stage timings for one week, updated only by convert_week's writing loop.
+
+    parse and serialize are CPU seconds summed over all parse workers, so
+    with a process pool they can exceed wall time; compress is time spent in
+    writer.write (compression plus file I/O, minus whatever gzip-mt or zstd
+    threads overlap); wait is time the writer sat idle waiting for the
+    next file in order. GET latency is the time a fetch took; with timed
+    reads it is only the request itself, and the time the GET queued for a
+    concurrency slot (or backed off after throttling) is kept apart.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.bytes_downloaded = 0
+        self.get_latencies: list[float] = []
+        self.get_queue_seconds: list[float] = []
+        self.parse_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.compress_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def add_get(self, size: int, seconds: float, queued: float = 0.0):
+        self.bytes_downloaded += size
+        self.get_latencies.append(seconds)
+        self.get_queue_seconds.append(queued)
+
+    def summary(self, records: int) -> dict:
+        wall = time.monotonic() - self.started
+        latencies = sorted(self.get_latencies)
+        queued = sorted(self.get_queue_seconds)
+        return {
+            "wall_seconds": round(wall, 3),
+            "bytes_downloaded": self.bytes_downloaded,
+            "gets": len(latencies),
+            "get_p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "get_p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "get_max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+            "get_queue_p50_ms": round(percentile(queued, 50) * 1000, 1),
+            "get_queue_p99_ms": round(percentile(queued, 99) * 1000, 1),
+            "parse_seconds": round(self.parse_seconds, 3),
+            "serialize_seconds": round(self.serialize_seconds, 3),
+            "compress_seconds": round(self.compress_seconds, 3),
+            "wait_seconds": round(self.wait_seconds, 3),
+            "records_per_second": round(records / wall, 1) if wall else 0.0,
+        }
+
+
+def format_metrics(metrics: dict) -> str:
+    """Summarize a StageMetrics summary on one line."""
+    queued = ""
+    if metrics["get_queue_p99_ms"]:
+        queued = (f" (queued p50 {metrics['get_queue_p50_ms']:.0f} ms "
+                  f"p99 {metrics['get_queue_p99_ms']:.0f} ms)")
+    return (
+        f"{metrics['bytes_downloaded'] / 1e6:.0f} MB in, "
+        f"GET p50 {metrics['get_p50_ms']:.0f} ms p99 {metrics['get_p99_ms']:.0f} ms{queued}, "
+        f"parse {metrics['parse_seconds']:.1f}s serialize {metrics['serialize_seconds']:.1f}s "
+        f"compress {metrics['compress_seconds']:.1f}s wait {metrics['wait_seconds']:.1f}s, "
+        f"{metrics['records_per_second']:.0f} records/s"
+    )
+
+
+@contextlib.contextmanager
+def abort_on_error(writer):
+    """Abort `writer`'s upload if the block raises, so S3 keeps no orphaned parts."""
+    try:
+        yield
+    except BaseException:
+        writer.abort()
+        raise
+
+
 def convert_week(
     week: str,
     keys: list[str],
@@ -196,12 +2236,73 @@ def convert_week(
     output_dir: str,
     workers: int,
     validate: bool,
+    parse_workers: int = 1,
+    max_inflight_bytes: int = DEFAULT_MAX_INFLIGHT_BYTES,
+    fmt: str = "jsonl",
+    partition_by: str | None = None,
+    fetch_pool: ThreadPoolExecutor | None = None,
+    parse_pool: ProcessPoolExecutor | None = None,
+    budget: InflightBudget | None = None,
+    progress: bool = True,
+    checkpoint_every: int = 0,
+    codec=None,
+    block_files: int = 0,
+    dedup: bool = False,
+    upload: S3Destination | None = None,
+    timed_reads: bool = False,
 ) -> dict:
-    """Convert all files for one ISO week into a gzipped JSONL file.
-
-    Returns a stats dict with counts.
+    """Convert all files for one ISO week into a gzipped JSONL (or Parquet) file.
+
+    With `partition_by`, the week is instead split into one file per
+    partition value (see PartitionedWeekWriter).
+
+    Streams the week instead of buffering it: keys are fetched in
+    chronological order on a thread pool of `workers`, parsed on a process
+    pool of `parse_workers` (1 = in the fetch threads), and each file is
+    written to the gzip stream as soon as every earlier file has been
+    written. At most a bounded window of files is in flight, and no new
+    fetch starts while downloaded-but-unwritten bodies exceed
+    `max_inflight_bytes` (a soft cap: in-progress fetches may overshoot it).
+
+    To run several weeks at once, pass the same `fetch_pool`, `parse_pool`
+    and `budget` to each call; they then share one download concurrency
+    limit, one parse pool and one in-flight byte cap. Pools passed in are
+    left running.
+
+    With `checkpoint_every`, JSONL output is checkpointed after every that
+    many files: the gzip member is finished, fsynced, and the last key and
+    byte offset are saved to `{output}.ckpt`. A later call for the same week
+    truncates the .tmp file to that offset, skips the keys already written
+    and appends from there.
+
+    JSONL output is compressed with `codec` (see COMPRESSIONS; default gzip).
+    With `block_files`, it is written as blocks of that many snapshot files
+    that each decompress on their own, indexed by snapshot_time in
+    `{output}.idx` (see read_time_range). With `dedup`, records that repeat
+    the previous snapshot unchanged are left out and listed in
+    `{output}.repeats` (see SnapshotDeduper); stats["repeated_records"]
+    counts them.
+
+    With `upload`, JSONL output streams straight into an S3 multipart
+    upload that is completed only if the week converts (see
+    S3MultipartWriter), and stats["output"] is its s3:// URL. Uploads are
+    never checkpointed; an interrupted week starts over.
+
+    JSONL checksums (line count, content and compressed CRC32, sampled
+    schema check) are gathered while writing and saved to
+    `{output}.manifest.json`; with `validate`, problems they show count as
+    errors. Parquet is validated by re-reading its metadata.
+
+    With `timed_reads`, read_fn returns (body, request seconds, queued
+    seconds), as AsyncS3Fetcher.read_timed does, and GET latency counts
+    only the request.
+
+    Returns a stats dict with counts, per-stage timings (`metrics`, see
+    StageMetrics) for the files converted in this call, the process's peak
+    RSS so far (shared by every week in flight) and how much that peak rose
+    while this week converted.
     """
-    output_path = os.path.join(output_dir, f"{week}.jsonl.gz")
+    output_path = output_path_for(output_dir, week, fmt, partition_by, codec)
 
     stats = {
         "week": week,
@@ -209,78 +2310,197 @@ def convert_week(
         "records": 0,
         "errors": 0,
         "error_keys": [],
-        "output": output_path,
+        "output": output_path if upload is None else upload.url_for(output_path),
     }
 
-    # Collect (key, raw_body) in parallel
-    file_data: list[tuple[str, str]] = []
     done_count = 0
     total = len(keys)
-
-    def fetch(key):
-        return key, read_fn(key)
-
-    with ThreadPoolExecutor(max_workers=workers) as pool:
-        futures = {pool.submit(fetch, key): key for key in keys}
-        for future in as_completed(futures):
-            key = futures[future]
+    window = max(workers, parse_workers) * 4
+    metrics = StageMetrics()
+    rss_before = peak_rss_mb()
+    records_before = 0
+    if budget is None:
+        budget = InflightBudget(max_inflight_bytes)
+
+    keys = sorted(keys)
+    checkpointing = (
+        checkpoint_every > 0 and upload is None and supports_checkpoints(fmt, partition_by)
+    )
+    resume = load_checkpoint(output_path) if checkpointing else None
+    index_blocks = block_files > 0 and OUTPUT_FORMATS[fmt].supports_blocks
+    if resume is not None:
+        index_blocks = resume.get("blocks") is not None
+        keys = [key for key in keys if key > resume["last_key"]]
+        done_count = total - len(keys)
+        for field in ("records", "errors", "error_keys"):
+            stats[field] = resume[field]
+        records_before = stats["records"]
+        stats["resumed_files"] = done_count
+        print(f"  {week}: resuming after {resume['last_key']} "
+              f"({done_count}/{total} files already written)", flush=True)
+
+    with contextlib.ExitStack() as stack:
+        if fetch_pool is None:
+            fetch_pool = stack.enter_context(ThreadPoolExecutor(max_workers=workers))
+        if parse_pool is None and parse_workers > 1:
+            parse_pool = ProcessPoolExecutor(max_workers=parse_workers)
+            stack.callback(parse_pool.shutdown, cancel_futures=True)
+
+        def fetch(key):
+            if timed_reads:
+                raw, get_seconds, queued = read_fn(key)
+            else:
+                t0 = time.perf_counter()
+                raw = read_fn(key)
+                get_seconds, queued = time.perf_counter() - t0, 0.0
+            budget.add(len(raw))
+            try:
+                if parse_pool is not None:
+                    return len(raw), (get_seconds, queued), parse_pool.submit(
+                        encode_file, key, raw, fmt, partition_by
+                    )
+                return len(raw), (get_seconds, queued), encode_file(key, raw, fmt, partition_by)
+            except BaseException:
+                # Never handed back for release, so give the bytes back here:
+                # the budget is shared with the other weeks in flight
+                budget.release(len(raw))
+                raise
+
+        # Parse and write (atomic: write to .tmp, rename on completion)
+        writer = stack.enter_context(contextlib.closing(open_week_writer(
+            output_dir, week, fmt, partition_by, codec, index_blocks, resume, dedup, upload,
+        )))
+        if upload is not None:
+            stack.enter_context(abort_on_error(writer))
+        pending: deque = deque()
+        key_iter = iter(keys)
+        block = {"first": None, "last": None, "records": 0}
+
+        def end_block():
+            if not index_blocks:
+                return
+            writer.end_block(block["first"], block["last"], block["records"])
+            block.update(first=None, last=None, records=0)
+
+        def fill_window():
+            # Always admit one file so a single oversized body can't stall
+            while len(pending) < window and (not pending or not budget.exhausted()):
+                key = next(key_iter, None)
+                if key is None:
+                    return
+                pending.append((key, fetch_pool.submit(fetch, key)))
+
+        fill_window()
+        while pending:
+            key, future = pending.popleft()
+            t_wait = time.perf_counter()
             try:
-                file_data.append(future.result())
+                size, (get_seconds, queued), result = future.result()
             except Exception as e:
+                metrics.wait_seconds += time.perf_counter() - t_wait
                 stats["errors"] += 1
                 stats["error_keys"].append(key)
                 print(f"  ERROR reading {key}: {e}", file=sys.stderr)
+            else:
+                metrics.add_get(size, get_seconds, queued)
+                try:
+                    _, chunk, count, error, (parse_s, serialize_s) = (
+                        result.result() if parse_pool is not None else result
+                    )
+                except Exception as e:
+                    chunk, count, error, parse_s, serialize_s = b"", 0, str(e), 0.0, 0.0
+                metrics.wait_seconds += time.perf_counter() - t_wait
+                metrics.parse_seconds += parse_s
+                metrics.serialize_seconds += serialize_s
+                if error is not None:
+                    stats["errors"] += 1
+                    stats["error_keys"].append(key)
+                    print(f"  ERROR parsing {key}: {error}", file=sys.stderr)
+                else:
+                    t_write = time.perf_counter()
+                    writer.write(chunk)
+                    metrics.compress_seconds += time.perf_counter() - t_write
+                    stats["records"] += count
+                    snapshot_time = snapshot_time_str(parse_filename_dt(key))
+                    block["first"] = block["first"] or snapshot_time
+                    block["last"] = snapshot_time
+                    block["records"] += count
+                budget.release(size)
+            fill_window()
+
             done_count += 1
-            if done_count % 500 == 0 or done_count == total:
-                print(f"\r    downloaded {done_count}/{total}", end="", flush=True)
-        if total >= 500:
+            if index_blocks and block_files and done_count % block_files == 0:
+                end_block()
+            if checkpointing and done_count % checkpoint_every == 0 and done_count < total:
+                end_block()
+                save_checkpoint(output_path, {
+                    "week": week,
+                    "last_key": key,
+                    "offset": writer.checkpoint(),
+                    "records": stats["records"],
+                    "errors": stats["errors"],
+                    "error_keys": stats["error_keys"],
+                    "blocks": writer.blocks,
+                    "checksums": writer.checksums,
+                    "repeats_offset": writer.repeats_offset,
+                })
+            if progress and (done_count % 500 == 0 or done_count == total):
+                print(f"\r    converted {done_count}/{total}", end="", flush=True)
+        if progress and total:
             print()  # newline after progress
+        end_block()
 
-    # Sort by key to maintain chronological order
-    file_data.sort(key=lambda x: x[0])
+    writer.commit()
+    clear_checkpoint(output_path)
 
-    # Parse and write JSONL (atomic: write to .tmp, rename on completion)
-    temp_path = output_path + ".tmp"
-    with gzip.open(temp_path, "wt", encoding="utf-8", compresslevel=6) as gz:
-        for key, raw in file_data:
-            dt = parse_filename_dt(key)
-            assert dt is not None, f"could not parse datetime from {key}"
-            snapshot_time = dt.isoformat()
-            try:
-                records = parse_records(raw, key)
-            except Exception as e:
-                stats["errors"] += 1
-                stats["error_keys"].append(key)
-                print(f"  ERROR parsing {key}: {e}", file=sys.stderr)
-                continue
+    if validate:
+        stats["errors"] += writer.validate(stats["records"])
+
+    stats["repeated_records"] = getattr(writer, "repeated_records", 0)
+    stats["peak_inflight_bytes"] = budget.peak
+    stats["peak_rss_mb"] = peak_rss_mb()
+    stats["peak_rss_growth_mb"] = stats["peak_rss_mb"] - rss_before
+    stats["peak_child_rss_mb"] = peak_rss_mb(resource.RUSAGE_CHILDREN)
+    stats["metrics"] = metrics.summary(stats["records"] - records_before)
+    return stats
 
-            for record in records:
-                record["snapshot_time"] = snapshot_time
-                gz.write(json.dumps(record, separators=(",", ":")) + "\n")
-                stats["records"] += 1
 
-    os.rename(temp_path, output_path)
+def week_metrics_line(stats: dict) -> dict:
+    """Return a week's counts and stage timings as one flat --metrics-file record."""
+    return {
+        "week": stats["week"],
+        "files": stats["files"],
+        "resumed_files": stats.get("resumed_files", 0),
+        "records": stats["records"],
+        "repeated_records": stats["repeated_records"],
+        "errors": stats["errors"],
+        "peak_inflight_bytes": stats["peak_inflight_bytes"],
+        "peak_rss_mb": round(stats["peak_rss_mb"], 1),
+        "peak_rss_growth_mb": round(stats["peak_rss_growth_mb"], 1),
+        "peak_child_rss_mb": round(stats["peak_child_rss_mb"], 1),
+        **stats["metrics"],
+    }
 
-    if validate:
-        # Re-read and verify each line is valid JSON
-        count = 0
-        with gzip.open(output_path, "rt", encoding="utf-8") as gz:
-            for line_no, line in enumerate(gz, 1):
-                try:
-                    obj = json.loads(line)
-                    assert "snapshot_time" in obj, f"missing snapshot_time on line {line_no}"
-                    count += 1
-                except (json.JSONDecodeError, AssertionError) as e:
-                    print(f"  VALIDATE ERROR {output_path}:{line_no}: {e}", file=sys.stderr)
-                    stats["errors"] += 1
-        if count != stats["records"]:
-            print(
-                f"  VALIDATE MISMATCH: wrote {stats['records']} but read back {count}",
-                file=sys.stderr,
-            )
-            stats["errors"] += 1
 
-    return stats
+def verify_outputs(output_dir: str, deep: bool = False) -> int:
+    """Verify every output under `output_dir` that has a manifest; return 1 on problems."""
+    suffix = output_manifest_path_for("")
+    failed = checked = 0
+    for root, _, files in sorted(os.walk(output_dir)):
+        for name in sorted(files):
+            if not name.endswith(suffix):
+                continue
+            output_path = os.path.join(root, name.removesuffix(suffix))
+            checked += 1
+            try:
+                problems = verify_output(output_path, deep)
+            except OSError as e:
+                problems = [str(e)]
+            if problems:
+                failed += 1
+                print(f"  {output_path}: {'; '.join(problems)}", file=sys.stderr)
+    print(f"Verified {checked} outputs: {checked - failed} OK, {failed} failed")
+    return 1 if failed else 0
 
 
 # --- Main -------------------------------------------------------------------
@@ -303,7 +2523,63 @@ def main():
     )
     parser.add_argument(
         "--output-dir", default="v2",
-        help="Output directory for JSONL.gz files (default: v2)",
+        help="Output directory for converted weekly files (default: v2)",
+    )
+    parser.add_argument(
+        "--format", choices=sorted(OUTPUT_FORMATS), default="jsonl", dest="fmt",
+        help="Output format: gzipped JSONL or typed Parquet (needs pyarrow) "
+             "(default: jsonl)",
+    )
+    parser.add_argument(
+        "--partition-by", choices=sorted(PARTITION_FIELDS),
+        help="Write one file per value instead of one per week, e.g. "
+             "route=19/week=2021-W45.jsonl.gz (default: no partitioning)",
+    )
+    parser.add_argument(
+        "--upload", metavar="S3_URL",
+        help="Stream each week's JSONL straight into a multipart upload under "
+             "this s3://bucket/prefix/ instead of keeping it in --output-dir, "
+             "which then only stages small sidecars; the object appears only "
+             "once the week is complete (no --partition-by or checkpoints)",
+    )
+    parser.add_argument(
+        "--part-size", type=parse_size, default=DEFAULT_PART_SIZE,
+        help="Multipart upload part size for --upload, at least 5M (default: 16M)",
+    )
+    parser.add_argument(
+        "--endpoint-url",
+        help="S3-compatible endpoint for reads and uploads, e.g. a local moto "
+             "or MinIO server (default: AWS_ENDPOINT_URL or S3)",
+    )
+    parser.add_argument(
+        "--compression", choices=sorted(COMPRESSIONS), default="gzip",
+        help="JSONL compression: gzip, gzip compressed on several threads "
+             "(same .gz format), or zstd (needs zstandard) (default: gzip)",
+    )
+    parser.add_argument(
+        "--compression-level", type=int,
+        help="Compression level (default: 6 for gzip, 3 for zstd)",
+    )
+    parser.add_argument(
+        "--compress-threads", type=int, default=os.cpu_count() or 1,
+        help="Threads per codec for gzip-mt and zstd (default: CPU count)",
+    )
+    parser.add_argument(
+        "--zstd-dict",
+        help="zstd dictionary file to compress with; copied to "
+             f"{{output-dir}}/{ZSTD_DICT_DIR}/ so readers can find it",
+    )
+    parser.add_argument(
+        "--block-files", type=int, default=DEFAULT_BLOCK_FILES,
+        help="Write JSONL as independently decompressible blocks of N snapshot "
+             "files, indexed by snapshot_time in {output}.idx "
+             f"(default: {DEFAULT_BLOCK_FILES}, 0=one stream, no index)",
+    )
+    parser.add_argument(
+        "--dedup", action="store_true",
+        help="Leave out records that repeat the previous snapshot unchanged "
+             "(layovers, stale GPS), listing them in {output}.repeats so "
+             "readers can expand the week back exactly (JSONL only)",
     )
     parser.add_argument(
         "--dry-run", action="store_true",
@@ -311,11 +2587,52 @@ def main():
     )
     parser.add_argument(
         "--validate", action="store_true",
-        help="Re-read output files to verify integrity",
+        help="Count line-count mismatches and schema errors found while writing "
+             "JSONL (or by re-reading Parquet) as errors",
+    )
+    parser.add_argument(
+        "--verify", nargs="?", const="quick", choices=["quick", "deep"],
+        help="Check outputs under --output-dir against their .manifest.json and "
+             "exit: quick compares compressed size and CRC32 without "
+             "decompressing, deep also checks line count and content CRC32",
+    )
+    parser.add_argument(
+        "--workers", type=int,
+        help="Download concurrency: the thread pool size, or with --fetcher async "
+             "the most requests the adaptive limit can grow to "
+             "(default: 16 threads, 256 async)",
+    )
+    parser.add_argument(
+        "--fetcher", choices=["threads", "async"], default="threads",
+        help="S3 GETs from a boto3 thread pool, or from an asyncio connection "
+             "pool whose concurrency backs off on 503 SlowDown and slow "
+             "responses (needs aiohttp) (default: threads)",
+    )
+    parser.add_argument(
+        "--parse-workers", type=int, default=os.cpu_count() or 1,
+        help="Process pool size for parsing/serializing "
+             "(default: CPU count, 1=no pool)",
+    )
+    parser.add_argument(
+        "--concurrent-weeks", type=int, default=2,
+        help="Weeks converted at once, sharing the download and parse pools "
+             "(default: 2)",
     )
     parser.add_argument(
-        "--workers", type=int, default=16,
-        help="Thread pool size for downloads (default: 16)",
+        "--max-inflight-bytes", type=parse_size, default=DEFAULT_MAX_INFLIGHT_BYTES,
+        help="Pause fetching while this many downloaded bytes are waiting to be "
+             "written, across all weeks in flight, e.g. 512M (default: 256M)",
+    )
+    parser.add_argument(
+        "--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY,
+        help="Checkpoint a week's partial output every N files so an interrupted "
+             "run resumes mid-week (JSONL without --partition-by only; "
+             f"default: {DEFAULT_CHECKPOINT_EVERY}, 0=off)",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        help="Append one JSON line of per-stage timings and settings per "
+             "converted week to this file, for comparing runs",
     )
     parser.add_argument(
         "--max-errors", type=int, default=100,
@@ -325,10 +2642,53 @@ def main():
         "--profile",
         help="AWS profile name for SSO/IAM auth (default: anonymous access)",
     )
+    parser.add_argument(
+        "--manifest",
+        help="SQLite key manifest to list weeks from and record converted weeks "
+             "in; built from S3 on first use",
+    )
+    parser.add_argument(
+        "--refresh-manifest", action="store_true",
+        help="List keys newer than the manifest's last key before converting",
+    )
     args = parser.parse_args()
 
+    if args.verify:
+        sys.exit(verify_outputs(args.output_dir, args.verify == "deep"))
     if not args.weeks and not args.all_weeks:
         parser.error("Specify --weeks or --all")
+    if args.manifest and args.local_dir:
+        parser.error("--manifest lists S3 keys; it can't be used with --local-dir")
+    if args.refresh_manifest and not args.manifest:
+        parser.error("--refresh-manifest needs --manifest")
+    if args.compression != "gzip" and not OUTPUT_FORMATS[args.fmt].uses_codec:
+        parser.error(f"--compression applies to JSONL; {args.fmt} output is compressed internally")
+    if args.upload:
+        if not args.upload.startswith("s3://"):
+            parser.error("--upload needs an s3://bucket/prefix/ URL")
+        if not OUTPUT_FORMATS[args.fmt].supports_upload:
+            parser.error(f"--upload applies to JSONL; {args.fmt} output is written locally")
+        if args.partition_by:
+            parser.error("--upload writes one object per week; it can't be used with --partition-by")
+        if args.part_size < 5 * 1024 * 1024:
+            parser.error("--part-size must be at least 5M (the S3 minimum)")
+    if args.endpoint_url:
+        # boto3 and AsyncS3Fetcher both pick this up
+        os.environ["AWS_ENDPOINT_URL"] = args.endpoint_url
+    if args.dedup and not OUTPUT_FORMATS[args.fmt].supports_dedup:
+        parser.error(f"--dedup applies to JSONL; {args.fmt} output can't be deduplicated")
+    if args.zstd_dict and args.compression != "zstd":
+        parser.error("--zstd-dict needs --compression zstd")
+    if args.fetcher == "async" and args.local_dir:
+        parser.error("--fetcher async reads from S3; it can't be used with --local-dir")
+    if args.workers is None:
+        args.workers = 256 if args.fetcher == "async" else 16
+
+    codec = make_codec(
+        args.compression, args.compression_level, args.compress_threads, args.zstd_dict,
+    )
+
+    manifest = open_manifest(args.manifest) if args.manifest else None
 
     # List source files and build week groups
     if args.local_dir:
@@ -338,6 +2698,15 @@ def main():
         if args.weeks:
             requested = set(args.weeks.split(","))
             weeks = {w: keys for w, keys in weeks.items() if w in requested}
+    elif manifest is not None:
+        # Cached listing: only list keys newer than the manifest when asked
+        s3_client = make_s3_client(args.profile)
+        if args.refresh_manifest or not manifest_key_count(manifest):
+            print("Updating key manifest from S3...", flush=True)
+            added = update_manifest(manifest, s3_client)
+            print(f"  added {added} keys, {manifest_key_count(manifest)} total")
+        weeks = manifest_keys_by_week(manifest, args.weeks.split(",") if args.weeks else None)
+        read_fn = lambda key: read_s3_file(s3_client, key)
     elif args.weeks:
         # Targeted listing: only list S3 keys for the requested weeks
         s3_client = make_s3_client(args.profile)
@@ -373,39 +2742,119 @@ def main():
 
     # Create output dir
     os.makedirs(args.output_dir, exist_ok=True)
-
-    # Convert each week
+    dict_path = codec.install(args.output_dir)
+    upload = None
+    if args.upload:
+        upload = S3Destination(
+            make_s3_client(args.profile, signed=True), args.upload, args.output_dir, args.part_size,
+        )
+        if dict_path is not None:
+            # Readers look for the dictionary next to the outputs
+            upload.upload_file(dict_path, remove=False)
+
+    # Convert each week, up to --concurrent-weeks at a time. Weeks share one
+    # download pool, one parse pool and one in-flight byte budget, so the
+    # next week's downloads overlap the current week's parse/compress tail.
     total_stats = {"files": 0, "records": 0, "errors": 0, "skipped": 0, "elapsed": 0.0}
     weeks_processed = 0
     weeks_total = len(weeks)
+    done_outputs = converted_outputs(manifest) if manifest is not None else set()
+    todo = []
     for week, keys in weeks.items():
-        output_path = os.path.join(args.output_dir, f"{week}.jsonl.gz")
-        if os.path.exists(output_path):
+        output_path = output_path_for(
+            args.output_dir, week, args.fmt, args.partition_by, codec
+        )
+        if upload.exists(output_path) if upload is not None else os.path.exists(output_path):
             print(f"  {week}: SKIP (output already exists)")
             total_stats["skipped"] += 1
-            continue
+        elif output_id(output_path if upload is None else upload.url_for(output_path)) in done_outputs:
+            print(f"  {week}: SKIP (converted according to manifest)")
+            total_stats["skipped"] += 1
+        else:
+            todo.append((week, keys))
+
+    concurrent = max(1, args.concurrent_weeks)
+    budget = InflightBudget(args.max_inflight_bytes)
 
-        print(f"  {week}: converting {len(keys)} files...", end=" ", flush=True)
+    def run_week(week, keys):
+        print(f"  {week}: converting {len(keys)} files...", flush=True)
         t0 = time.monotonic()
-        stats = convert_week(week, keys, read_fn, args.output_dir, args.workers, args.validate)
-        elapsed = time.monotonic() - t0
-        print(f"{stats['records']} records, {stats['errors']} errors, {elapsed:.0f}s")
-
-        total_stats["files"] += stats["files"]
-        total_stats["records"] += stats["records"]
-        total_stats["errors"] += stats["errors"]
-        total_stats["elapsed"] += elapsed
-        weeks_processed += 1
-
-        weeks_left = weeks_total - total_stats["skipped"] - weeks_processed
-        avg = total_stats["elapsed"] / weeks_processed
-        eta = weeks_left * avg
-        print(f"    avg {avg:.0f}s/week, ~{weeks_left} left, ETA {eta/3600:.1f}h", flush=True)
-
-        if args.max_errors and total_stats["errors"] >= args.max_errors:
-            print(f"\nABORTING: {total_stats['errors']} errors reached --max-errors {args.max_errors}",
-                  file=sys.stderr)
-            sys.exit(1)
+        stats = convert_week(
+            week, keys, read_fn, args.output_dir, args.workers, args.validate,
+            args.parse_workers, args.max_inflight_bytes, args.fmt, args.partition_by,
+            fetch_pool=fetch_pool, parse_pool=parse_pool, budget=budget,
+            progress=concurrent == 1, checkpoint_every=args.checkpoint_every,
+            codec=codec, block_files=args.block_files, dedup=args.dedup, upload=upload,
+            timed_reads=fetcher is not None,
+        )
+        return stats, time.monotonic() - t0
+
+    t_start = time.monotonic()
+    fetcher = None
+    run_info = {
+        "run_started": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "workers": args.workers,
+        "parse_workers": args.parse_workers,
+        "concurrent_weeks": concurrent,
+        "fetcher": args.fetcher,
+        "format": args.fmt,
+        "partition_by": args.partition_by,
+        "compression": args.compression,
+        "dedup": args.dedup,
+        "upload": bool(args.upload),
+    }
+    with contextlib.ExitStack() as stack:
+        if args.fetcher == "async":
+            # Fetch threads only wait on the event loop, which sets the real concurrency
+            fetcher = stack.enter_context(AsyncS3Fetcher(
+                args.profile,
+                max_concurrency=args.workers,
+                initial_concurrency=min(DEFAULT_INITIAL_CONCURRENCY, args.workers),
+            ))
+            read_fn = fetcher.read_timed
+        fetch_pool = stack.enter_context(ThreadPoolExecutor(max_workers=args.workers))
+        parse_pool = None
+        if args.parse_workers > 1:
+            parse_pool = stack.enter_context(ProcessPoolExecutor(max_workers=args.parse_workers))
+        week_pool = stack.enter_context(ThreadPoolExecutor(max_workers=concurrent))
+        futures = {week_pool.submit(run_week, week, keys): week for week, keys in todo}
+        for future in as_completed(futures):
+            stats, elapsed = future.result()
+            dropped = (f" ({stats['repeated_records']} repeats dropped)"
+                       if stats["repeated_records"] else "")
+            print(f"  {stats['week']}: {stats['records']} records{dropped}, {stats['errors']} errors, "
+                  f"{elapsed:.0f}s, process peak RSS {stats['peak_rss_mb']:.0f} MB "
+                  f"(+{stats['peak_rss_growth_mb']:.0f} MB during this week)")
+            print(f"    {format_metrics(stats['metrics'])}")
+            if args.metrics_file:
+                with open(args.metrics_file, "a") as f:
+                    f.write(json.dumps({**run_info, **week_metrics_line(stats)}) + "\n")
+            if manifest is not None:
+                mark_week_converted(manifest, stats)
+
+            total_stats["files"] += stats["files"]
+            total_stats["records"] += stats["records"]
+            total_stats["errors"] += stats["errors"]
+            total_stats["elapsed"] = time.monotonic() - t_start
+            weeks_processed += 1
+
+            weeks_left = weeks_total - total_stats["skipped"] - weeks_processed
+            avg = total_stats["elapsed"] / weeks_processed
+            eta = weeks_left * avg
+            print(f"    avg {avg:.0f}s/week, ~{weeks_left} left, ETA {eta/3600:.1f}h", flush=True)
+            if fetcher is not None:
+                fs = fetcher.stats()
+                print(f"    fetcher: concurrency {fs['limit']} (peak {fs['peak_limit']}), "
+                      f"{fs['throttled']} throttled/failed of {fs['requests']} GETs", flush=True)
+
+            if args.max_errors and total_stats["errors"] >= args.max_errors:
+                print(f"\nABORTING: {total_stats['errors']} errors reached --max-errors {args.max_errors}",
+                      file=sys.stderr)
+                # Weeks already converting finish; queued weeks never start
+                week_pool.shutdown(cancel_futures=True)
+                sys.exit(1)
 
     print(f"\nDone: {total_stats['files']} files → {total_stats['records']} records, "
           f"{total_stats['errors']} errors, {total_stats['skipped']} skipped, "
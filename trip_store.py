@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Columnar store of completed trips, in place of the pickled DataFrames.
+
+A store is a directory with one route={N}/ directory per route. Each holds
+one .npy file per column, fixed width and sorted by trip_start, plus a
+meta.json with the row count, the column types and the values of the
+dictionary-coded string columns. read_trips memory-maps the columns, so
+opening a route's history costs a few file opens whatever its length, and
+processes reading the same route share its pages through the OS cache.
+A sketches.json keeps quantile sketches of the trips' durations (see
+trip_sketches), for percentiles without the trips.
+
+trip_start and trip_end are stored as epoch ms of the naive local time
+extract_trips gives them (its wall clock, not UTC), so they come back
+unchanged. duration and weekday are derived from stored columns when
+read, and trip_start_time (Python objects) only when asked for.
+
+Usage:
+    from trip_store import read_trips
+    df = read_trips("completed_bus_routes", 19)
+
+    python trip_store.py completed_bus_routes
+"""
+
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from quantile_sketch import SketchTable
+
+# Stored column -> numpy type, or 'dict' for dictionary-coded strings
+STORE_COLUMNS = {
+    'trip_start': 'int64', # local wall-clock epoch ms
+    'trip_end': 'int64',
+    'duration_minutes': 'float64',
+    'distance': 'float64',
+    'delay': 'int32',
+    'delay_start': 'int32',
+    'delay_end': 'int32',
+    'first_stop': 'int32',
+    'last_stop': 'int32',
+    'block_start': 'dict',
+    'block_end': 'dict',
+    'vehicleID': 'int32',
+    'type': 'dict',
+    'tripID': 'int64',
+    'situation': 'dict',
+    'routeNumber': 'int32',
+    'direction': 'int8',
+    'bearing': 'int16',
+    'lastLocID': 'int32',
+    'lastStopSeq': 'int16',
+    'loadPercentage': 'float32',
+    'hour': 'int8',
+    'weekday_num': 'int8',
+    'time_of_day': 'int32',
+}
+
+# Columns of an extracted trip, in order; time features are added after
+# (see find_completed_routes.extract_trips)
+TRIP_COLUMNS = [
+    'duration',
+    'distance',
+    'delay', # at last stop observation
+    'trip_start',
+    'trip_end',
+    'delay_start',
+    'delay_end',
+    'first_stop',
+    'last_stop',
+    'block_start',
+    'block_end',
+    'vehicleID',
+    'type',
+    'tripID',
+    'situation',
+    'routeNumber',
+    'direction',
+    'bearing',
+    'lastLocID',
+    'lastStopSeq',
+    'loadPercentage', # at last stop observation
+]
+
+# Columns of a trip DataFrame, in order: TRIP_COLUMNS, then add_time_features'
+TRIP_FRAME_COLUMNS = TRIP_COLUMNS + [
+    'weekday', 'hour', 'weekday_num', 'trip_start_time', 'time_of_day', 'duration_minutes',
+]
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def route_path(store_dir: str, route_number) -> str:
+    return os.path.join(store_dir, f"route={route_number}")
+
+
+def store_routes(store_dir: str) -> list[int]:
+    """Return the route numbers in a store, in order."""
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(
+        int(name.removeprefix("route="))
+        for name in os.listdir(store_dir)
+        if name.startswith("route=") and name.removeprefix("route=").isdigit()
+    )
+
+
+def trip_sketches(trips: pd.DataFrame) -> SketchTable:
+    """Return a SketchTable of trips' durations in minutes.
+
+    Keys are (route, first_stop, last_stop, weekday_num, hour), with
+    weekday_num & hour of trip_start as add_time_features gives them.
+    """
+    sketches = SketchTable()
+    keys = ['routeNumber', 'first_stop', 'last_stop', 'weekday_num', 'hour']
+    minutes = trips.duration / pd.Timedelta(minutes=1)
+    for key, durations in minutes.groupby([trips[k] for k in keys], sort=True):
+        sketches.sketch(tuple(int(k) for k in key)).extend(durations.tolist())
+    return sketches
+
+
+def write_route(trips: pd.DataFrame, path: str):
+    """Write one route's trips (sorted here by trip_start) to `path`, atomically."""
+    trips = trips.sort_values('trip_start', kind='stable')
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    meta = {"rows": len(trips), "columns": STORE_COLUMNS, "dictionaries": {}}
+    for name, dtype in STORE_COLUMNS.items():
+        values = trips[name]
+        if dtype == 'dict':
+            codes, uniques = pd.factorize(values.astype(str), sort=True)
+            values = codes.astype('int32')
+            meta["dictionaries"][name] = uniques.tolist()
+        elif name in ('trip_start', 'trip_end'):
+            values = values.to_numpy().astype('datetime64[ms]').view('int64')
+        else:
+            values = values.to_numpy().astype(dtype)
+        np.save(os.path.join(tmp, name + ".npy"), values)
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    with open(os.path.join(tmp, "sketches.json"), "w") as f:
+        json.dump(trip_sketches(trips).state(), f)
+
+    # Readers that already mapped the old columns keep them until they let go
+    if os.path.exists(path):
+        os.rename(path, path + ".old")
+        os.rename(tmp, path)
+        shutil.rmtree(path + ".old")
+    else:
+        os.rename(tmp, path)
+
+
+def write_trips(routes: pd.DataFrame, store_dir: str) -> list[int]:
+    """Save trips as extract_trips* return them; return the routes written.
+
+    Each route's trips for the stop pairs in `routes` replace the ones
+    stored for those pairs; its other pairs' trips are kept.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    written = []
+    for route_number, trips in routes.groupby('routeNumber'):
+        route_number = int(route_number)
+        path = route_path(store_dir, route_number)
+        if os.path.exists(path):
+            old = read_trips(store_dir, route_number)
+            pairs = set(zip(trips.first_stop, trips.last_stop))
+            other_pairs = [pair not in pairs for pair in zip(old.first_stop, old.last_stop)]
+            trips = pd.concat([old[other_pairs], trips[[c for c in old.columns]]], ignore_index=True)
+        write_route(trips, path)
+        written.append(route_number)
+    return written
+
+
+def read_trips(store_dir: str, route_number, columns: list[str] | None = None) -> pd.DataFrame:
+    """Return a route's trips, oldest first, with memory-mapped columns.
+
+    Columns are those of the DataFrames extract_trips* return (by default
+    all but trip_start_time, which is a Python object per trip). Strings
+    come back as categoricals, numbers as their stored width, and times as
+    datetime64[ms]; stored columns are read-only views of the files.
+    """
+    path = route_path(store_dir, route_number)
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if columns is None:
+        columns = [c for c in TRIP_FRAME_COLUMNS if c != 'trip_start_time']
+
+    def stored(name):
+        values = np.load(os.path.join(path, name + ".npy"), mmap_mode='r')
+        if name in meta["dictionaries"]:
+            return pd.Categorical.from_codes(values, meta["dictionaries"][name])
+        if name in ('trip_start', 'trip_end'):
+            return values.view('datetime64[ms]')
+        return values
+
+    data = {}
+    for name in columns:
+        if name == 'duration':
+            data[name] = stored('trip_end') - stored('trip_start')
+        elif name == 'weekday':
+            data[name] = pd.Categorical.from_codes(stored('weekday_num'), WEEKDAYS)
+        elif name == 'trip_start_time':
+            data[name] = pd.Series(stored('trip_start')).dt.time.to_numpy()
+        else:
+            data[name] = stored(name)
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def read_sketches(store_dir: str, route_number) -> SketchTable:
+    """A route's duration sketches, keyed (route, first_stop, last_stop, weekday, hour)."""
+    with open(os.path.join(route_path(store_dir, route_number), "sketches.json")) as f:
+        return SketchTable.from_state(json.load(f))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the routes in a trip store.")
+    parser.add_argument("store_dir", help="Trip store directory, e.g. completed_bus_routes")
+    args = parser.parse_args()
+
+    for route_number in store_routes(args.store_dir):
+        trips = read_trips(args.store_dir, route_number, ['trip_start', 'first_stop', 'last_stop'])
+        pairs = trips.groupby(['first_stop', 'last_stop']).size()
+        print(f"route {route_number}: {len(trips)} trips, {len(pairs)} stop pairs, "
+              f"{trips.trip_start.min()} to {trips.trip_start.max()}")
+
+
+if __name__ == "__main__":
+    main()